@@ -0,0 +1,135 @@
+"""
+Memory and ready-time benchmark of the gateway profiles
+
+Feeds discord.py's own gateway state parser a synthetic session - READY,
+a GUILD_CREATE per guild (channels, roles, emojis, members in voice) and a
+stream of MESSAGE_CREATE events with typing and reaction events in between,
+the latter only where the profile's intents would have them delivered - and
+reports the time from READY to the ready event and the process's RSS after
+the messages. Each profile runs in its own process (GATEWAY_PROFILE is read
+at import). The ready time includes discord.py's 2 s wait for the last
+GUILD_CREATE.
+
+Usage: python benchmarks/bench_gateway.py [--guilds N] [--messages N]
+"""
+import argparse
+import asyncio
+import gc
+import itertools
+import json
+import os
+import subprocess
+import sys
+import time
+
+from common import load_bot_module
+from fake_discord import JOINED, guild_payload, message_payload
+
+PROFILES = ("default", "lean")
+
+
+def current_rss_bytes():
+    """Resident set size right now (Linux only)"""
+    try:
+        with open("/proc/self/statm") as f:
+            return int(f.read().split()[1]) * os.sysconf("SC_PAGE_SIZE")
+    except (OSError, ValueError):
+        return None
+
+
+async def run_profile(module, guilds, messages):
+    bot = module.bot
+    state = bot._connection
+    ready = asyncio.Event()
+
+    def dispatch(event, *args, **kwargs):
+        if event == "ready":
+            ready.set()
+    state.dispatch = dispatch
+    state.call_handlers = lambda *args, **kwargs: None
+
+    ids = itertools.count(10 ** 17, 3)
+    bot_user = {"id": str(next(ids)), "username": "mediabot", "discriminator": "0", "avatar": None, "bot": True}
+    users = [{"id": str(next(ids)), "username": f"user{n}", "discriminator": "0", "avatar": f"{n:032x}",
+              "global_name": f"User {n}"} for n in range(500)]
+    payloads = []
+    for _ in range(guilds):
+        guild_id = next(ids)
+        payloads.append((guild_id,) + guild_payload(guild_id, ids, bot_user, users))
+
+    gc.collect()
+    rss_start = current_rss_bytes() or 0
+
+    started = time.perf_counter()
+    state.parse_ready({
+        "v": 10, "user": bot_user, "session_id": "bench", "resume_gateway_url": "wss://localhost",
+        "guilds": [{"id": str(guild_id), "unavailable": True} for guild_id, _, _ in payloads],
+        "application": {"id": bot_user["id"], "flags": 0},
+    })
+    for _, payload, _ in payloads:
+        state.parse_guild_create(payload)
+        await asyncio.sleep(0)
+    await ready.wait()
+    ready_s = time.perf_counter() - started
+
+    intents = state._intents
+    started = time.perf_counter()
+    for n in range(messages):
+        guild_id, _, channel_ids = payloads[n % guilds]
+        channel_id = channel_ids[n % len(channel_ids)]
+        user = users[n % len(users)]
+        if intents.guild_typing:
+            state.parse_typing_start({"channel_id": str(channel_id), "guild_id": str(guild_id),
+                                      "user_id": user["id"], "timestamp": 0,
+                                      "member": {"user": user, "roles": [], "joined_at": JOINED, "flags": 0}})
+        state.parse_message_create(message_payload(next(ids), guild_id, channel_id, user))
+        if intents.guild_reactions:
+            state.parse_message_reaction_add({"user_id": user["id"], "channel_id": str(channel_id),
+                                              "message_id": str(next(ids)), "guild_id": str(guild_id),
+                                              "emoji": {"id": None, "name": "😂"}, "type": 0, "burst": False})
+    messages_s = time.perf_counter() - started
+
+    gc.collect()
+    rss_end = current_rss_bytes() or 0
+    me = state._get_guild(payloads[0][0]).me
+    return {
+        "ready_s": round(ready_s, 3),
+        "us_per_message": round(messages_s / max(messages, 1) * 1e6, 1),
+        "rss_growth_mb": round((rss_end - rss_start) / 2 ** 20, 1),
+        "rss_mb": round(rss_end / 2 ** 20, 1),
+        "cached_messages": len(state._messages or ()),
+        "cached_members": sum(len(guild._members) for guild in state.guilds),
+        "guild_me_cached": me is not None,
+    }
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[1])
+    parser.add_argument("--guilds", type=int, default=500, help="guilds in the session")
+    parser.add_argument("--messages", type=int, default=20_000, help="MESSAGE_CREATE events after READY")
+    parser.add_argument("--profile", choices=PROFILES, help=argparse.SUPPRESS)  # Set in the child processes
+    args = parser.parse_args()
+
+    if args.profile:
+        module = load_bot_module()
+        results = asyncio.run(run_profile(module, args.guilds, args.messages))
+        print(json.dumps(results))
+        return
+
+    results = {}
+    for profile in PROFILES:
+        output = subprocess.run(
+            [sys.executable, os.path.abspath(__file__), "--profile", profile,
+             "--guilds", str(args.guilds), "--messages", str(args.messages)],
+            env=dict(os.environ, GATEWAY_PROFILE=profile), capture_output=True, text=True, check=True
+        ).stdout
+        results[profile] = json.loads(output.strip().splitlines()[-1])
+
+    print(f"{args.guilds} guilds, {args.messages} messages")
+    print(f"{'metric':<18}" + "".join(f"{profile:>12}" for profile in PROFILES))
+    for metric in results[PROFILES[0]]:
+        print(f"{metric:<18}" + "".join(f"{results[profile][metric]!s:>12}" for profile in PROFILES))
+
+
+if __name__ == "__main__":
+    main()
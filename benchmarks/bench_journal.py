@@ -0,0 +1,54 @@
+"""
+Micro-benchmark for the queue journal
+
+Measures what journaling adds to each message on the event loop (recording
+it queued and then finished), and how long the background group commits
+take to write those records to SQLite.
+
+Usage: python benchmarks/bench_journal.py [--messages N]
+"""
+import argparse
+import asyncio
+import os
+import tempfile
+import time
+
+from common import load_bot_module
+
+
+async def bench(QueueJournal, path, messages):
+    journal = QueueJournal(path)
+    journal.load(max_pending_age=300)
+
+    start = time.perf_counter()
+    for message_id in range(messages):
+        journal.queued(message_id, 42)
+        journal.finished(message_id, 42, copied=True)
+        if message_id % 100 == 0:
+            await asyncio.sleep(0)  # Let the loop run commits as it would between messages
+    hot_path_us = (time.perf_counter() - start) / messages * 1e6
+
+    start = time.perf_counter()
+    journal.close()
+    drain_s = time.perf_counter() - start
+    return hot_path_us, drain_s, journal._commits
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[1])
+    parser.add_argument("--messages", type=int, default=100_000, help="messages to journal")
+    args = parser.parse_args()
+
+    QueueJournal = load_bot_module().QueueJournal
+    path = os.path.join(tempfile.mkdtemp(prefix="mediabot-bench-"), "queue_journal.db")
+    hot_path_us, drain_s, commits = asyncio.run(bench(QueueJournal, path, args.messages))
+
+    print(f"{args.messages} messages, queued + finished each")
+    print(f"on the event loop: {hot_path_us:.2f} us/message")
+    print(f"group commits:     {commits} (final flush took {drain_s * 1000:.1f} ms)")
+    if drain_s > 0:
+        print(f"commit throughput: {args.messages * 2 / drain_s:,.0f} records/s (at most)")
+
+
+if __name__ == "__main__":
+    main()
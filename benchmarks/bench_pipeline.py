@@ -0,0 +1,198 @@
+"""
+End-to-end benchmark of the copy pipeline
+
+Drives MediaCopyBot through on_message -> queue -> copy workers -> send with
+synthetic traffic from FakeGateway, against LocalDiscord (a local CDN and
+send endpoint with latency, rate limits and 429s). Runs with no network.
+Reports copied messages/s, p50/p99 latency from queueing to the copy being
+sent, and peak RSS, and compares them against a stored baseline.
+
+With --hot-share, that fraction of the traffic floods one guild (or the first
+--hot-guilds guilds), and the p99 latency of the other (quiet) guilds is
+reported separately - it should stay bounded however far behind the hot
+guilds fall, also with more hot guilds than copy workers.
+
+link_p50_s is the median latency of link posts alone, and missed_embeds
+counts link posts that unfurled but were never copied because the bot gave
+up on their embed. With --lost-edits, that fraction of unfurl edits never
+reaches the bot, so those links are copied only after their embed wait;
+with --cached-unfurls, that fraction of link posts arrive already unfurled.
+
+Usage: python benchmarks/bench_pipeline.py [--rate N] [--duration S] [--mix upload=6,link=2,twitter=1,chat=1]
+                                         [--hot-share F] [--hot-guilds N] [--lost-edits F] [--cached-unfurls F]
+                                         [--name NAME] [--save-baseline] [--check]
+"""
+import argparse
+import asyncio
+import json
+import logging
+import os
+import statistics
+import tempfile
+import time
+
+from common import load_bot_module
+from fake_discord import FakeGateway, LocalDiscord
+
+BASELINE_FILE = os.path.join(os.path.dirname(os.path.abspath(__file__)), "baseline.json")
+
+# Worse than the baseline by more than this fraction counts as a regression
+TOLERANCE = 0.15
+
+
+def parse_mix(text):
+    mix = {}
+    for part in text.split(","):
+        kind, _, weight = part.partition("=")
+        if kind not in FakeGateway.KINDS:
+            raise argparse.ArgumentTypeError(f"unknown message kind {kind!r}")
+        mix[kind] = float(weight or 1)
+    return mix
+
+
+def percentile(values, fraction):
+    if not values:
+        return None
+    ordered = sorted(values)
+    return ordered[min(len(ordered) - 1, int(fraction * len(ordered)))]
+
+
+async def run(module, args):
+    bot = module.bot
+    server = LocalDiscord(
+        send_latency=args.send_latency,
+        send_limit=args.send_limit,
+        error_rate=args.error_rate,
+        seed=args.seed
+    )
+    await server.start()
+    gateway = FakeGateway(bot, server, guilds=args.guilds, seed=args.seed)
+    await gateway.start()
+
+    started = time.monotonic()
+    await gateway.run(args.rate, args.duration, args.mix, max_files=args.files, file_size=args.file_size,
+                      hot_share=args.hot_share, lost_edits=args.lost_edits,
+                      cached_unfurls=args.cached_unfurls, hot_guilds=args.hot_guilds)
+    drained = await gateway.drain()
+    elapsed = (gateway.last_copy or time.monotonic()) - (gateway.first_enqueue or started)
+
+    await gateway.close()
+    await server.close()
+
+    results = {
+        "copied": gateway.copied,
+        "queued": len(gateway.enqueued_at),
+        "drained": drained,
+        "msgs_per_s": round(gateway.copied / elapsed, 2) if elapsed > 0 else 0.0,
+        "p50_s": round(percentile(gateway.latencies, 0.5) or 0, 3),
+        "p99_s": round(percentile(gateway.latencies, 0.99) or 0, 3),
+        "mean_s": round(statistics.fmean(gateway.latencies), 3) if gateway.latencies else 0.0,
+        "link_p50_s": round(percentile(gateway.link_latencies, 0.5) or 0, 3),
+        "missed_embeds": gateway.missed_embeds,
+        "sends": server.stats["sends"],
+        "rate_limited": server.stats["rate_limited"],
+        "refetch_calls_saved": bot.refetch_calls_saved,
+        "peak_rss_mb": round((module.peak_rss_bytes() or 0) / 2 ** 20, 1),
+    }
+    if args.hot_share:
+        quiet = [latency for guild_id, latencies in gateway.latencies_by_guild.items()
+                 if guild_id not in gateway.hot_guild_ids for latency in latencies]
+        hot = [latency for guild_id in gateway.hot_guild_ids
+               for latency in gateway.latencies_by_guild.get(guild_id, [])]
+        results["quiet_p99_s"] = round(percentile(quiet, 0.99) or 0, 3)
+        results["hot_p99_s"] = round(percentile(hot, 0.99) or 0, 3)
+    return results
+
+
+def compare(results, baseline):
+    """Print results next to the baseline and return the regressed metrics"""
+    regressions = []
+    print(f"{'metric':<22} {'result':>10} {'baseline':>10} {'change':>8}")
+    for metric, value in results.items():
+        before = baseline.get(metric)
+        # No more link posts should lose their embed
+        if metric == "missed_embeds" and isinstance(before, int) and value > before:
+            regressions.append(metric)
+        if isinstance(value, bool) or not isinstance(before, (int, float)) or not before:
+            print(f"{metric:<22} {value!s:>10} {before!s:>10}")
+            continue
+        change = (value - before) / before
+        print(f"{metric:<22} {value:>10} {before:>10} {change:>+8.1%}")
+        # Throughput should not drop; latency and memory should not grow
+        if metric == "msgs_per_s" and change < -TOLERANCE:
+            regressions.append(metric)
+        elif metric in ("p50_s", "p99_s", "quiet_p99_s", "link_p50_s", "peak_rss_mb") and change > TOLERANCE:
+            regressions.append(metric)
+    return regressions
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[1])
+    parser.add_argument("--rate", type=float, default=10, help="messages per second")
+    parser.add_argument("--duration", type=float, default=10, help="seconds of traffic")
+    parser.add_argument("--mix", type=parse_mix, default="upload=6,link=2,twitter=1,chat=1",
+                        help="relative weights of message kinds")
+    parser.add_argument("--guilds", type=int, default=16, help="servers, each with its own media channel")
+    parser.add_argument("--files", type=int, default=4, help="most attachments per upload")
+    parser.add_argument("--file-size", type=int, default=200_000, help="typical attachment size in bytes")
+    parser.add_argument("--send-latency", type=float, default=0.1, help="seconds per send")
+    parser.add_argument("--send-limit", type=int, default=5, help="sends per channel per 5 seconds")
+    parser.add_argument("--error-rate", type=float, default=0.01, help="chance of a spurious 429 per send")
+    parser.add_argument("--hot-share", type=float, default=0.0,
+                        help="fraction of messages sent to the busy guilds")
+    parser.add_argument("--hot-guilds", type=int, default=1, help="busy guilds sharing --hot-share")
+    parser.add_argument("--lost-edits", type=float, default=0.0,
+                        help="fraction of unfurl edits that never reach the bot")
+    parser.add_argument("--cached-unfurls", type=float, default=0.0,
+                        help="fraction of link posts that arrive already unfurled")
+    parser.add_argument("--seed", type=int, default=0)
+    parser.add_argument("--name", default="default", help="baseline entry to compare with")
+    parser.add_argument("--save-baseline", action="store_true", help="store these results as the baseline")
+    parser.add_argument("--check", action="store_true", help="exit 1 if worse than the baseline")
+    args = parser.parse_args()
+    if isinstance(args.mix, str):
+        args.mix = parse_mix(args.mix)
+
+    logging.getLogger("mediabot").setLevel(logging.WARNING)
+    module = load_bot_module()
+    # The bot keeps its media index in the working directory
+    os.chdir(tempfile.mkdtemp(prefix="mediabot-bench-"))
+    results = asyncio.run(run(module, args))
+
+    params = {key: value for key, value in vars(args).items()
+              if key not in ("name", "save_baseline", "check")}
+    for key in ("hot_share", "lost_edits", "cached_unfurls"):
+        if not params[key]:
+            del params[key]  # Keep matching baselines recorded before it existed
+    if params["hot_guilds"] == 1:
+        del params["hot_guilds"]
+    baselines = {}
+    if os.path.exists(BASELINE_FILE):
+        with open(BASELINE_FILE) as f:
+            baselines = json.load(f)
+
+    if args.save_baseline:
+        baselines[args.name] = {"params": params, "results": results}
+        with open(BASELINE_FILE, "w") as f:
+            json.dump(baselines, f, indent=4)
+            f.write("\n")
+        print(json.dumps(results, indent=4))
+        print(f"Saved as baseline {args.name!r}")
+        return
+
+    baseline = baselines.get(args.name)
+    if baseline is None:
+        print(json.dumps(results, indent=4))
+        print(f"No baseline {args.name!r} yet - run with --save-baseline to store one")
+        return
+    if baseline["params"] != params:
+        print(f"Note: baseline {args.name!r} was recorded with different parameters: {baseline['params']}")
+    regressions = compare(results, baseline["results"])
+    if regressions:
+        print(f"Regressed: {', '.join(regressions)}")
+        if args.check:
+            raise SystemExit(1)
+
+
+if __name__ == "__main__":
+    main()
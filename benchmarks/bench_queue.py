@@ -0,0 +1,118 @@
+"""
+Micro-benchmark for the message queue
+
+Measures the per-message cost of the on_message path (dedup lookup +
+enqueue) and of completing an item, as queue depth grows. The indexed
+MessageQueue should stay flat; the old list scan is shown for comparison.
+
+Then measures the memory each queued message holds: a QueueItem with a
+MessageRecord, against the dict holding a full discord.Message (built by
+discord.py from a gateway payload) that the queue used to keep.
+
+Usage: python benchmarks/bench_queue.py [--ops N] [--items N]
+"""
+import argparse
+import gc
+import itertools
+import time
+import tracemalloc
+import types
+from datetime import datetime
+
+import discord
+
+from common import load_bot_module
+from fake_discord import guild_payload, message_payload
+
+DEPTHS = [100, 1_000, 10_000, 50_000]
+
+
+def bench_indexed(module, depth, ops):
+    queue = module.MessageQueue()
+    now = datetime.now()
+    message = types.SimpleNamespace(guild=types.SimpleNamespace(id=1))
+    for message_id in range(depth):
+        queue.push(message_id, module.QueueItem(message, now, 1e12 + message_id, False), 1e12 + message_id)
+    
+    start = time.perf_counter()
+    for message_id in range(depth, depth + ops):
+        if message_id not in queue:
+            queue.push(message_id, module.QueueItem(message, now, 1e12 + message_id, False), 1e12 + message_id)
+    enqueue_ns = (time.perf_counter() - start) / ops * 1e9
+    
+    # Hand the new items out and complete them one by one
+    queue.in_flight.update((message_id, queue.pending.pop(message_id)) for message_id in range(depth, depth + ops))
+    start = time.perf_counter()
+    for message_id in range(depth, depth + ops):
+        queue.complete(message_id)
+    complete_ns = (time.perf_counter() - start) / ops * 1e9
+    return enqueue_ns, complete_ns
+
+
+def bench_list_scan(depth, ops):
+    queue = [{'id': message_id} for message_id in range(depth)]
+    start = time.perf_counter()
+    for message_id in range(depth, depth + ops):
+        if not any(item['id'] == message_id for item in queue):
+            queue.append({'id': message_id})
+    return (time.perf_counter() - start) / ops * 1e9
+
+
+def bench_memory(module, items):
+    """Bytes retained per queued message: (full Message in a dict, QueueItem + MessageRecord)"""
+    state = module.bot._connection
+    ids = itertools.count(10 ** 17, 3)
+    bot_user = {"id": str(next(ids)), "username": "mediabot", "discriminator": "0", "avatar": None, "bot": True}
+    users = [{"id": str(next(ids)), "username": f"user{n}", "discriminator": "0", "avatar": f"{n:032x}",
+              "global_name": f"User {n}"} for n in range(500)]
+    guild_id = next(ids)
+    payload, channel_ids = guild_payload(guild_id, ids, bot_user, users)
+    guild = discord.Guild(data=payload, state=state)
+    state._add_guild(guild)
+    channels = [guild.get_channel(channel_id) for channel_id in channel_ids]
+    now = datetime.now()
+    
+    def build(n):
+        channel = channels[n % len(channels)]
+        data = message_payload(next(ids), guild_id, channel.id, users[n % len(users)])
+        return discord.Message(state=state, channel=channel, data=data)
+    
+    def measure(make_item):
+        gc.collect()
+        tracemalloc.start()
+        before = tracemalloc.get_traced_memory()[0]
+        queue = [make_item(build(n)) for n in range(items)]
+        gc.collect()
+        retained = tracemalloc.get_traced_memory()[0] - before
+        tracemalloc.stop()
+        del queue
+        return retained / items
+    
+    old = measure(lambda message: {'message': message, 'time': now, 'ready_at': 0.0, 'embeds_loaded': False})
+    new = measure(lambda message: module.QueueItem(module.MessageRecord.from_message(message), now, 0.0, False))
+    return old, new
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[1])
+    parser.add_argument("--ops", type=int, default=2_000, help="messages measured per depth")
+    parser.add_argument("--items", type=int, default=10_000, help="queued messages for the memory measurement")
+    args = parser.parse_args()
+    
+    module = load_bot_module()
+    
+    print(f"{'depth':>8} {'enqueue ns/msg':>16} {'complete ns/msg':>16} {'list scan ns/msg':>18}")
+    for depth in DEPTHS:
+        enqueue_ns, complete_ns = bench_indexed(module, depth, args.ops)
+        # The list scan is quadratic overall, so measure it with fewer ops
+        scan_ns = bench_list_scan(depth, max(1, args.ops // 20))
+        print(f"{depth:>8} {enqueue_ns:>16.0f} {complete_ns:>16.0f} {scan_ns:>18.0f}")
+    
+    old, new = bench_memory(module, args.items)
+    print(f"\nmemory per queued message ({args.items} queued)")
+    print(f"  dict + discord.Message:     {old:>8.0f} bytes")
+    print(f"  QueueItem + MessageRecord:  {new:>8.0f} bytes ({old / new:.1f}x smaller)")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,28 @@
+"""Shared helpers for the offline benchmarks"""
+import importlib.util
+import os
+import sys
+import tempfile
+
+BOT_SCRIPT = os.path.join(os.path.dirname(os.path.dirname(os.path.abspath(__file__))), "discord-media-bot.py")
+
+
+def load_bot_module():
+    """
+    Import discord-media-bot.py as a module without starting the bot
+    
+    The script creates its bot (and a default bot_config.json) at import
+    time, so it is imported from a scratch directory to keep the real
+    config untouched. It is registered in sys.modules so its functions can
+    be pickled into the image process pool.
+    """
+    cwd = os.getcwd()
+    os.chdir(tempfile.mkdtemp(prefix="mediabot-bench-"))
+    try:
+        spec = importlib.util.spec_from_file_location("mediabot", BOT_SCRIPT)
+        module = importlib.util.module_from_spec(spec)
+        sys.modules["mediabot"] = module
+        spec.loader.exec_module(module)
+    finally:
+        os.chdir(cwd)
+    return module
@@ -0,0 +1,440 @@
+"""
+Offline stand-ins for Discord used by the pipeline benchmark
+
+LocalDiscord is a local aiohttp server playing both Discord's CDN (serving
+attachment bytes) and the message send endpoint (with latency, per-channel
+rate-limit headers and injected 429s). The fake guild, channel and message
+classes carry just the attributes MediaCopyBot reads, and FakeGateway feeds
+the bot messages and link-unfurl edits the way the real gateway would.
+"""
+import asyncio
+import itertools
+import os
+import random
+import time
+import types
+
+import aiohttp
+import discord
+from aiohttp import web
+
+MAX_ATTACHMENT_SIZE = 8 * 1024 * 1024
+
+
+class LocalDiscord:
+    """Local CDN and send endpoint - no network needed"""
+
+    def __init__(self, send_latency=0.1, send_jitter=0.05, send_limit=5, send_window=5.0,
+                 error_rate=0.0, cdn_latency=0.02, seed=0):
+        self.send_latency = send_latency
+        self.send_jitter = send_jitter
+        self.send_limit = send_limit  # sends per channel per send_window, like Discord's
+        self.send_window = send_window
+        self.error_rate = error_rate  # chance of a spurious 429 on any send
+        self.cdn_latency = cdn_latency
+        self.random = random.Random(seed)
+        self.base_url = None
+        self.stats = {"downloads": 0, "sends": 0, "rate_limited": 0, "bytes_uploaded": 0}
+        self._windows = {}  # channel id -> (window start, sends in window)
+        self._message_ids = itertools.count(1)
+        self._blob = os.urandom(MAX_ATTACHMENT_SIZE)
+        self._runner = None
+
+    async def start(self):
+        app = web.Application(client_max_size=64 * 1024 * 1024)
+        app.router.add_get("/attachments/{size}/{name}", self._serve_attachment)
+        app.router.add_post("/api/v10/channels/{channel_id}/messages", self._create_message)
+        self._runner = web.AppRunner(app, access_log=None)
+        await self._runner.setup()
+        site = web.TCPSite(self._runner, "127.0.0.1", 0)
+        await site.start()
+        port = site._server.sockets[0].getsockname()[1]
+        self.base_url = f"http://127.0.0.1:{port}"
+
+    async def close(self):
+        if self._runner is not None:
+            await self._runner.cleanup()
+
+    def attachment_url(self, name: str, size: int) -> str:
+        return f"{self.base_url}/attachments/{size}/{name}"
+
+    async def _serve_attachment(self, request):
+        await asyncio.sleep(self.cdn_latency)
+        self.stats["downloads"] += 1
+        size = int(request.match_info["size"])
+        # A unique prefix keeps every file's hash distinct, so dedup never kicks in
+        prefix = request.match_info["name"].encode()[:size]
+        return web.Response(body=prefix + self._blob[:size - len(prefix)])
+
+    async def _create_message(self, request):
+        channel_id = int(request.match_info["channel_id"])
+        body = await request.read()
+        now = time.monotonic()
+
+        started, count = self._windows.get(channel_id, (now, 0))
+        if now - started >= self.send_window:
+            started, count = now, 0
+        reset_after = self.send_window - (now - started)
+        if count >= self.send_limit or self.random.random() < self.error_rate:
+            self.stats["rate_limited"] += 1
+            return web.json_response(
+                {"message": "You are being rate limited.", "retry_after": reset_after, "global": False},
+                status=429,
+                headers={"Retry-After": f"{reset_after:.3f}"}
+            )
+        count += 1
+        self._windows[channel_id] = (started, count)
+
+        await asyncio.sleep(max(0.0, self.random.gauss(self.send_latency, self.send_jitter)))
+        self.stats["sends"] += 1
+        self.stats["bytes_uploaded"] += len(body)
+        return web.json_response(
+            {"id": next(self._message_ids), "channel_id": channel_id},
+            headers={
+                "X-RateLimit-Limit": str(self.send_limit),
+                "X-RateLimit-Remaining": str(self.send_limit - count),
+                "X-RateLimit-Reset-After": f"{reset_after:.3f}"
+            }
+        )
+
+
+class FakeAttachment:
+    def __init__(self, attachment_id, filename, size, url):
+        self.id = attachment_id
+        self.filename = filename
+        self.size = size
+        self.url = url
+
+    def is_spoiler(self):
+        return False
+
+
+class FakeMessage:
+    def __init__(self, message_id, channel, author, content="", attachments=(), embeds=()):
+        self.id = message_id
+        self.channel = channel
+        self.guild = channel.guild
+        self.author = author
+        self.content = content
+        self.attachments = list(attachments)
+        self.embeds = list(embeds)
+        self.created_at = discord.utils.utcnow()
+        self.jump_url = f"https://discord.com/channels/{self.guild.id}/{channel.id}/{message_id}"
+
+
+class FakeChannel:
+    """A text channel whose sends go to LocalDiscord through the bot's rate-limit hook"""
+
+    def __init__(self, channel_id, name, guild, gateway):
+        self.id = channel_id
+        self.name = name
+        self.guild = guild
+        self.mention = f"<#{channel_id}>"
+        self.messages = {}
+        self._gateway = gateway
+
+    def permissions_for(self, member):
+        return discord.Permissions.all()
+
+    async def send(self, files=(), embeds=(), **kwargs):
+        payload = discord.utils._to_json({"embeds": [embed.to_dict() for embed in embeds]})
+        uploads = [(file.filename, file.fp.read()) for file in files]
+        url = f"{self._gateway.server.base_url}/api/v10/channels/{self.id}/messages"
+
+        # Retry 429s after Retry-After, as discord.py does
+        while True:
+            form = aiohttp.FormData()
+            form.add_field("payload_json", payload)
+            for index, (filename, data) in enumerate(uploads):
+                form.add_field(f"files[{index}]", data, filename=filename)
+            async with self._gateway.http.post(url, data=form) as resp:
+                data = await resp.json()
+                if resp.status != 429:
+                    resp.raise_for_status()
+                    return types.SimpleNamespace(
+                        id=data["id"],
+                        jump_url=f"https://discord.com/channels/{self.guild.id}/{self.id}/{data['id']}"
+                    )
+                await asyncio.sleep(float(resp.headers["Retry-After"]))
+
+    async def fetch_message(self, message_id):
+        await asyncio.sleep(self._gateway.server.send_latency)
+        return self.messages[message_id]
+
+    async def history(self, limit=100, after=None, oldest_first=True, **kwargs):
+        await asyncio.sleep(self._gateway.server.send_latency)
+        newer = [message_id for message_id in sorted(self.messages) if after is None or message_id > after.id]
+        for message_id in newer[:limit]:
+            yield self.messages[message_id]
+
+
+# Gateway payloads, for benchmarks that drive discord.py's own state parser
+
+JOINED = "2024-01-01T00:00:00+00:00"
+
+
+def guild_payload(guild_id, ids, bot_user, users, channels=20, roles=10, emojis=20, in_voice=5):
+    channel_ids = [next(ids) for _ in range(channels)]
+    voice_channel = next(ids)
+    voice_users = users[:in_voice]
+    return {
+        "id": str(guild_id),
+        "name": f"guild {guild_id}",
+        "owner_id": users[0]["id"],
+        "member_count": 5000,
+        "large": True,
+        "features": [],
+        "roles": [{"id": str(guild_id), "name": "@everyone", "permissions": "104324673", "position": 0,
+                   "color": 0, "hoist": False, "managed": False, "mentionable": False}]
+                 + [{"id": str(next(ids)), "name": f"role {n}", "permissions": "0", "position": n + 1,
+                     "color": 0, "hoist": False, "managed": False, "mentionable": False} for n in range(roles)],
+        "emojis": [{"id": str(next(ids)), "name": f"emoji{n}", "roles": [], "require_colons": True,
+                    "managed": False, "animated": False, "available": True} for n in range(emojis)],
+        "channels": [{"id": str(channel_id), "type": 0, "name": f"chat-{n}", "position": n,
+                      "permission_overwrites": [], "topic": "memes and more", "nsfw": False}
+                     for n, channel_id in enumerate(channel_ids)]
+                    + [{"id": str(voice_channel), "type": 2, "name": "voice", "position": channels,
+                        "permission_overwrites": [], "bitrate": 64000, "user_limit": 0}],
+        # Without the members intent Discord only sends the bot and members in voice
+        "members": [{"user": user, "roles": [], "joined_at": JOINED, "flags": 0}
+                    for user in [bot_user] + voice_users],
+        "voice_states": [{"user_id": user["id"], "channel_id": str(voice_channel), "session_id": "x",
+                          "deaf": False, "mute": False, "self_deaf": False, "self_mute": False,
+                          "self_video": False, "suppress": False} for user in voice_users],
+        "threads": [],
+        "stickers": [],
+        "guild_scheduled_events": [],
+        "stage_instances": [],
+        "soundboard_sounds": [],
+        "presences": [],
+    }, channel_ids
+
+
+def message_payload(message_id, guild_id, channel_id, user):
+    return {
+        "id": str(message_id),
+        "channel_id": str(channel_id),
+        "guild_id": str(guild_id),
+        "author": user,
+        "member": {"roles": [], "joined_at": JOINED, "flags": 0},
+        "content": f"look at this https://example.com/{message_id}.png",
+        "timestamp": "2026-01-01T00:00:00+00:00",
+        "edited_timestamp": None,
+        "tts": False,
+        "mention_everyone": False,
+        "mentions": [],
+        "mention_roles": [],
+        "attachments": [{"id": str(message_id + 1), "filename": "meme.png", "size": 250000,
+                         "url": f"https://cdn.discordapp.com/attachments/{channel_id}/{message_id}/meme.png",
+                         "proxy_url": f"https://media.discordapp.net/attachments/{channel_id}/{message_id}/meme.png",
+                         "width": 1080, "height": 1080, "content_type": "image/png"}],
+        "embeds": [{"type": "image", "url": f"https://example.com/{message_id}.png",
+                    "thumbnail": {"url": f"https://example.com/{message_id}.png", "width": 800, "height": 600}}],
+        "pinned": False,
+        "type": 0,
+    }
+
+
+class FakeGateway:
+    """
+    Drives a MediaCopyBot with synthetic traffic
+
+    Sets up `guilds` servers, each with `channels` monitored channels and a
+    media channel, routes the bot's REST traffic to LocalDiscord, and emits
+    messages as a Poisson process. Link posts are followed by an unfurl edit
+    after a delay (or never, for 1 - unfurl_rate of them), like the gateway's
+    MESSAGE_UPDATE. For lost_edits of the unfurls the edit event never
+    reaches the bot (the embed only shows up when the message is fetched),
+    which leaves it to the bot's embed wait. cached_unfurls of the link
+    posts arrive already unfurled, as when Discord has the link's preview
+    cached, and get no edit at all.
+    """
+
+    KINDS = ("upload", "link", "twitter", "chat")
+
+    def __init__(self, bot, server: LocalDiscord, guilds=8, channels=2, authors=20, seed=0):
+        self.bot = bot
+        self.server = server
+        self.random = random.Random(seed)
+        self.channels = {}
+        self.sources = []
+        self.authors = [
+            types.SimpleNamespace(
+                id=1000 + n, bot=False, display_name=f"user{n}",
+                display_avatar=types.SimpleNamespace(url=f"https://cdn.example/avatars/{n}.png")
+            )
+            for n in range(authors)
+        ]
+        self.enqueued_at = {}
+        self.link_ids = set()
+        self.unfurled = set()
+        self.copied_ids = set()
+        self.link_latencies = []
+        self.latencies = []
+        self.latencies_by_guild = {}
+        self.copied = 0
+        self.first_enqueue = None
+        self.last_copy = None
+        self.http = None
+        self._ids = itertools.count(10 ** 17)
+        self._unfurls = set()
+
+        self.guild_sources = []
+        for guild_number in range(guilds):
+            guild = types.SimpleNamespace(
+                id=next(self._ids), me=types.SimpleNamespace(id=1), filesize_limit=25 * 1024 * 1024
+            )
+            media_channel = self._add_channel(f"media-{guild_number}", guild)
+            monitored = [self._add_channel(f"chat-{guild_number}-{n}", guild).id for n in range(channels)]
+            self.sources.extend(self.channels[channel_id] for channel_id in monitored)
+            self.guild_sources.append([self.channels[channel_id] for channel_id in monitored])
+            guild_id = str(guild.id)
+            bot.config["media_channels"][guild_id] = media_channel.id
+            bot.config["monitored_channels"][guild_id] = monitored
+            bot.config["include_author"][guild_id] = True
+            bot.config["monitor_all"][guild_id] = False
+            bot.config["excluded_channels"][guild_id] = []
+            bot.config["duplicate_media"][guild_id] = "skip"
+        bot.save_config()
+
+    def _add_channel(self, name, guild):
+        channel = FakeChannel(next(self._ids), name, guild, self)
+        self.channels[channel.id] = channel
+        return channel
+
+    async def start(self):
+        """Wire the bot to the fakes and start its batch processor and copy workers"""
+        bot = self.bot
+
+        # Sends report their rate-limit headers to the bot like its own HTTP client would
+        trace = aiohttp.TraceConfig()
+        trace.on_request_end.append(bot._on_discord_response)
+        self.http = aiohttp.ClientSession(trace_configs=[trace])
+
+        async def ready():
+            pass
+        bot.wait_until_ready = ready
+        bot.get_channel = self.channels.get
+
+        copy_media_messages = bot.copy_media_messages
+
+        async def timed_copy(messages):
+            copied = await copy_media_messages(messages)
+            if copied:
+                now = time.monotonic()
+                self.last_copy = now
+                for message in messages:
+                    self.copied += 1
+                    self.copied_ids.add(message.id)
+                    latency = now - self.enqueued_at[message.id]
+                    self.latencies.append(latency)
+                    if message.id in self.link_ids:
+                        self.link_latencies.append(latency)
+                    self.latencies_by_guild.setdefault(message.guild.id, []).append(latency)
+            return copied
+        bot.copy_media_messages = timed_copy
+
+        self.tasks = [asyncio.create_task(bot._batch_processor())]
+        self.tasks += [asyncio.create_task(bot._copy_worker()) for _ in range(bot.copy_workers)]
+
+    async def close(self):
+        for task in self.tasks:
+            task.cancel()
+        await asyncio.gather(*self.tasks, *self._unfurls, return_exceptions=True)
+        await self.http.close()
+        await self.bot.close()
+
+    async def run(self, rate, duration, mix, max_files=4, file_size=200_000,
+                  unfurl_delay=1.0, twitter_unfurl_delay=3.0, unfurl_rate=0.9, hot_share=0.0, lost_edits=0.0,
+                  cached_unfurls=0.0, hot_guilds=1):
+        """
+        Send messages at `rate` per second for `duration` seconds, kinds weighted by `mix`
+
+        hot_share of the messages go to the first hot_guilds guilds (a flood
+        in busy servers); the rest are spread over all channels.
+        """
+        self.hot_guilds = hot_guilds
+        self._hot_sources = [channel for sources in self.guild_sources[:hot_guilds] for channel in sources]
+        kinds = list(mix)
+        weights = [mix[kind] for kind in kinds]
+        deadline = time.monotonic() + duration
+        while time.monotonic() < deadline:
+            await asyncio.sleep(self.random.expovariate(rate))
+            kind = self.random.choices(kinds, weights)[0]
+            hot = self.random.random() < hot_share
+            message = self._make_message(kind, max_files, file_size, hot)
+            # (No extra draw when off, so runs stay comparable with older baselines)
+            cached = kind in ("link", "twitter") and cached_unfurls and self.random.random() < cached_unfurls
+            if cached:
+                message.embeds = [self._link_embed(message)]
+                self.unfurled.add(message.id)
+            message.channel.messages[message.id] = message
+            if kind != "chat":
+                self.enqueued_at[message.id] = time.monotonic()
+                if self.first_enqueue is None:
+                    self.first_enqueue = self.enqueued_at[message.id]
+            await self.bot.on_message(message)
+
+            if kind in ("link", "twitter"):
+                self.link_ids.add(message.id)
+            if kind in ("link", "twitter") and not cached and self.random.random() < unfurl_rate:
+                delay = twitter_unfurl_delay if kind == "twitter" else unfurl_delay
+                lost = lost_edits and self.random.random() < lost_edits
+                task = asyncio.create_task(self._unfurl(message, self.random.uniform(0.5, 1.5) * delay, lost))
+                self._unfurls.add(task)
+                task.add_done_callback(self._unfurls.discard)
+
+    async def drain(self, timeout=60.0):
+        """Wait until every queued message has been copied or dropped"""
+        bot = self.bot
+        deadline = time.monotonic() + timeout
+        while time.monotonic() < deadline:
+            if not self._unfurls and not len(bot.message_queue) and not bot.copy_lanes and not bot.refresh_tasks:
+                return True
+            await asyncio.sleep(0.05)
+        return False
+
+    @property
+    def hot_guild_ids(self):
+        return {sources[0].guild.id for sources in self.guild_sources[:self.hot_guilds]}
+
+    def _make_message(self, kind, max_files, file_size, hot=False):
+        channel = self.random.choice(self._hot_sources if hot else self.sources)
+        author = self.random.choice(self.authors)
+        message_id = next(self._ids)
+        if kind == "upload":
+            attachments = []
+            for index in range(self.random.randint(1, max_files)):
+                name = f"{message_id}-{index}.png"
+                size = max(64, min(MAX_ATTACHMENT_SIZE, int(self.random.uniform(0.5, 1.5) * file_size)))
+                attachments.append(FakeAttachment(next(self._ids), name, size, self.server.attachment_url(name, size)))
+            return FakeMessage(message_id, channel, author, attachments=attachments)
+        if kind == "link":
+            return FakeMessage(message_id, channel, author, content=f"look https://example.com/{message_id}.png")
+        if kind == "twitter":
+            return FakeMessage(message_id, channel, author, content=f"https://x.com/someone/status/{message_id}")
+        return FakeMessage(message_id, channel, author, content="just chatting")
+
+    @property
+    def missed_embeds(self):
+        """Link posts that did unfurl but were never copied (the bot gave up on their embed)"""
+        return len(self.unfurled - self.copied_ids)
+
+    @staticmethod
+    def _link_embed(message):
+        url = message.content.split()[-1]
+        if "x.com" in url:
+            embed = discord.Embed(type="rich", url=url, description="a post")
+        else:
+            embed = discord.Embed(type="image", url=url)
+        embed.set_image(url=url)
+        return embed
+
+    async def _unfurl(self, message, delay, lost=False):
+        await asyncio.sleep(delay)
+        embed = self._link_embed(message)
+        updated = FakeMessage(message.id, message.channel, message.author, content=message.content, embeds=[embed])
+        message.channel.messages[message.id] = updated
+        self.unfurled.add(message.id)
+        if not lost:
+            await self.bot.on_raw_message_edit(types.SimpleNamespace(message_id=message.id, message=updated))
@@ -3,15 +3,38 @@ from discord import app_commands
 from discord.ext import commands
 import json
 import os
+import sys
+import math
+import multiprocessing
+import queue
 import aiohttp
+from aiohttp import web
 import asyncio
-from typing import Optional, List, Dict, Any, Set
+import heapq
+import itertools
+import time
+from typing import Optional, List, Dict, Any, Set, Tuple, Literal, Callable
 import logging
 import io
 import re
+import contextlib
+import copy
+import tempfile
+import types
+import hashlib
+import sqlite3
+import shutil
+import weakref
+from concurrent.futures import ThreadPoolExecutor, ProcessPoolExecutor
+from collections import OrderedDict, deque
 from dotenv import load_dotenv
 from datetime import datetime, timedelta
 
+try:
+    from PIL import Image
+except ImportError:  # Perceptual hashing is skipped without Pillow
+    Image = None
+
 # Configure logging
 logging.basicConfig(level=logging.INFO)
 logger = logging.getLogger(__name__)
@@ -19,59 +42,1632 @@ logger = logging.getLogger(__name__)
 # Load environment variables
 load_dotenv()
 
+# Sharding - SHARD_COUNT runs the bot as an AutoShardedBot ("auto" lets Discord
+# pick the count), SHARD_IDS (e.g. "0,2") limits this process to some shards.
+# With CLUSTERS=n the launcher sets these for each cluster process it starts.
+SHARD_COUNT = os.getenv("SHARD_COUNT")
+SHARD_IDS = os.getenv("SHARD_IDS")
+CLUSTER_ID = os.getenv("CLUSTER_ID")
+BotBase = commands.AutoShardedBot if SHARD_COUNT else commands.Bot
+
+# Gateway profile - GATEWAY_PROFILE=lean subscribes only to guild and guild
+# message events and caches only what the bot reads: no message cache (edits
+# arrive as raw events) and no members besides the bot's own
+GATEWAY_PROFILE = os.getenv("GATEWAY_PROFILE", "default").lower()
+
 # Configuration file path
 CONFIG_FILE = "bot_config.json"
 
-class MediaCopyBot(commands.Bot):
+# SQLite config store, used instead of CONFIG_FILE when CONFIG_BACKEND=sqlite
+CONFIG_DB_FILE = "bot_config.db"
+
+# Per-guild config sections (each maps guild_id -> setting)
+CONFIG_SECTIONS = ("monitored_channels", "media_channels", "include_author",
+                   "monitor_all", "excluded_channels", "duplicate_media", "backfill")
+
+# Prefix for text commands (slash commands are the primary interface)
+COMMAND_PREFIX = "!"
+
+# Content-hash index of media already copied, per guild
+MEDIA_INDEX_FILE = "media_index.db"
+
+# Journal of queued messages, replayed after a restart
+QUEUE_JOURNAL_FILE = "queue_journal.db"
+
+# Attachments are streamed from the CDN in chunks of this size
+DOWNLOAD_CHUNK_SIZE = 64 * 1024
+
+# REST route used to send messages, for reading its rate-limit headers
+CHANNEL_MESSAGES_PATH = re.compile(r'/channels/(\d+)/messages$')
+
+# Attachment types that count as media
+MEDIA_EXTENSIONS = ('.png', '.jpg', '.jpeg', '.gif', '.webp', '.mp4',
+                    '.mov', '.avi', '.webm', '.mkv', '.bmp', '.tiff')
+
+# Source message ID in the "Jump to Original" links of copies
+JUMP_URL_PATTERN = re.compile(r'/channels/\d+/\d+/(\d+)')
+
+# Any link that Discord might unfurl into a media embed
+URL_PATTERN = re.compile(r'https?://', re.IGNORECASE)
+
+# The site of every link in a message, in one pass (matches wherever URL_PATTERN does)
+LINK_PATTERN = re.compile(r'https?://(?:www\.|m\.|mobile\.)?([^\s/?#:<>|]*)', re.IGNORECASE)
+
+# Hosts that unfurl like another site, so they share its embed latency estimate
+SITE_ALIASES = {
+    "x.com": "twitter.com", "fxtwitter.com": "twitter.com", "vxtwitter.com": "twitter.com",
+    "fixupx.com": "twitter.com", "youtu.be": "youtube.com", "redd.it": "reddit.com",
+    "old.reddit.com": "reddit.com", "i.redd.it": "reddit.com", "i.imgur.com": "imgur.com",
+    "vm.tiktok.com": "tiktok.com", "media.tenor.com": "tenor.com"
+}
+
+# Attachments that get a perceptual hash as well as a SHA-256
+HASHABLE_IMAGE_EXTENSIONS = ('.png', '.jpg', '.jpeg', '.webp', '.bmp')
+
+# Perceptual hashes with fewer set (or clear) bits than this come from
+# near-uniform images - solid colours, text on a plain background - which
+# all hash alike, so they aren't used for matching
+MIN_DHASH_BITS = 8
+
+# Images that can be re-encoded to fit a guild's upload limit
+RECOMPRESSIBLE_EXTENSIONS = ('.png', '.jpg', '.jpeg', '.webp')
+
+# Videos and GIFs that can be transcoded to MP4 with ffmpeg to fit a guild's upload limit
+# (all of them in MEDIA_EXTENSIONS, or the message is never queued)
+TRANSCODABLE_EXTENSIONS = ('.mp4', '.mov', '.avi', '.webm', '.mkv', '.gif')
+
+# Duplicate media handling modes (per guild)
+DUPLICATE_MODES = ("skip", "link", "off")
+
+# Single-message REST path (fetch_message), next to CHANNEL_MESSAGES_PATH
+CHANNEL_MESSAGE_PATH = re.compile(r'/channels/\d+/messages/\d+$')
+
+# Histogram buckets (seconds) for the metrics endpoint
+LATENCY_BUCKETS = (0.5, 1, 2, 3, 5, 8, 10, 15, 30, 60, 120)
+OVERSHOOT_BUCKETS = (0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1, 2.5, 5)
+
+def image_dhash(fp) -> Optional[int]:
+    """
+    64-bit difference hash of an image, or None if it cannot be decoded
+    
+    Resizes to 9x8 greyscale and records whether each pixel is brighter than
+    its right neighbour, so re-encoded or resized copies of the same image
+    hash the same. Also None for near-uniform images (see MIN_DHASH_BITS).
+    CPU bound - run it in an executor.
+    """
+    try:
+        with Image.open(fp) as image:
+            image.draft("L", (64, 64))  # Let JPEG decode at reduced size
+            pixels = list(image.convert("L").resize((9, 8)).getdata())
+    except Exception:
+        return None
+    
+    bits = 0
+    for row in range(8):
+        for col in range(8):
+            left = pixels[row * 9 + col]
+            bits = (bits << 1) | (left > pixels[row * 9 + col + 1])
+    set_bits = bin(bits).count("1")
+    if min(set_bits, 64 - set_bits) < MIN_DHASH_BITS:
+        return None
+    return bits
+
+def shrink_image(data: bytes, filename: str, max_bytes: int) -> Optional[tuple]:
+    """
+    Re-encode an image to at most max_bytes, returning (bytes, filename)
+    
+    Tries lower JPEG qualities at full size first (WebP for images with
+    transparency), then keeps scaling the image down by a quarter. Returns
+    None for animations, undecodable data, or images that will not fit.
+    CPU bound - run it in a process pool.
+    """
+    try:
+        with Image.open(io.BytesIO(data)) as image:
+            if getattr(image, "is_animated", False):
+                return None
+            image.load()
+            if image.mode in ("RGBA", "LA") or "transparency" in image.info:
+                image = image.convert("RGBA")
+                image_format, extension = "WEBP", ".webp"
+            else:
+                image = image.convert("RGB")
+                image_format, extension = "JPEG", ".jpg"
+            
+            attempts = [(1.0, quality) for quality in (90, 80, 70)]
+            attempts += [(0.75 ** step, 80) for step in range(1, 9)]
+            for scale, quality in attempts:
+                resized = image
+                if scale < 1.0:
+                    size = (max(1, int(image.width * scale)), max(1, int(image.height * scale)))
+                    resized = image.resize(size, Image.LANCZOS)
+                output = io.BytesIO()
+                resized.save(output, image_format, quality=quality, optimize=True)
+                if output.tell() <= max_bytes:
+                    return output.getvalue(), os.path.splitext(filename)[0] + extension
+    except Exception:
+        return None
+    return None
+
+async def run_process(*command: str) -> tuple:
+    """
+    Run a subprocess and return (returncode, stdout, stderr)
+    
+    The process is killed if the calling task is cancelled (e.g. timed out),
+    and runs under nice where available so it yields CPU to the bot itself.
+    """
+    nice = shutil.which("nice")
+    if nice:
+        command = (nice, "-n", "10") + command
+    process = await asyncio.create_subprocess_exec(
+        *command,
+        stdout=asyncio.subprocess.PIPE,
+        stderr=asyncio.subprocess.PIPE
+    )
+    try:
+        stdout, stderr = await process.communicate()
+    except asyncio.CancelledError:
+        process.kill()
+        await process.wait()
+        raise
+    return process.returncode, stdout, stderr
+
+def parse_guild_weights(text: str) -> Dict[int, float]:
+    """Parse GUILD_WEIGHTS ("guild_id:weight,guild_id:weight") into a dict"""
+    weights = {}
+    for entry in text.split(","):
+        if not entry.strip():
+            continue
+        guild_id, _, weight = entry.partition(":")
+        try:
+            weights[int(guild_id)] = float(weight)
+        except ValueError:
+            logger.warning(f"Ignoring bad GUILD_WEIGHTS entry {entry!r}")
+    return weights
+
+# Discord's per-message limits
+MAX_FILES_PER_MESSAGE = 10
+MAX_EMBEDS_PER_MESSAGE = 10
+
+def link_sites(content: str) -> Tuple[str, ...]:
+    """Sites linked in a message, in order and without repeats ("" for a link with no host)"""
+    sites = []
+    for host in LINK_PATTERN.findall(content or ""):
+        host = host.lower().rstrip(".")
+        host = SITE_ALIASES.get(host, host)
+        if host not in sites:
+            sites.append(host)
+    return tuple(sites)
+
+def pack_sends(downloads: list, embeds: list, max_bytes: int) -> list:
+    """
+    Split a copy into (downloads, embeds) sends that fit Discord's limits
+    
+    Files are packed in order, at most MAX_FILES_PER_MESSAGE and max_bytes
+    per send; embeds in groups of MAX_EMBEDS_PER_MESSAGE. The two are lined
+    up from the end so the last send carries the last embed (the info embed)
+    and as few sends as possible are made.
+    """
+    file_groups = []
+    group = []
+    group_bytes = 0
+    for download in downloads:
+        if group and (len(group) == MAX_FILES_PER_MESSAGE or group_bytes + download.size > max_bytes):
+            file_groups.append(group)
+            group = []
+            group_bytes = 0
+        group.append(download)
+        group_bytes += download.size
+    if group:
+        file_groups.append(group)
+    
+    embed_groups = [embeds[i:i + MAX_EMBEDS_PER_MESSAGE] for i in range(0, len(embeds), MAX_EMBEDS_PER_MESSAGE)]
+    
+    count = max(len(file_groups), len(embed_groups))
+    file_groups = [[]] * (count - len(file_groups)) + file_groups
+    embed_groups = [[]] * (count - len(embed_groups)) + embed_groups
+    return list(zip(file_groups, embed_groups))
+
+def peak_rss_bytes() -> Optional[int]:
+    """Peak resident set size of this process, if the platform reports it"""
+    try:
+        import resource
+    except ImportError:  # Windows
+        return None
+    peak = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+    return peak if sys.platform == "darwin" else peak * 1024  # Linux reports KiB
+
+class AttachmentRecord:
+    """The parts of a discord.Attachment needed to copy it"""
+    
+    __slots__ = ('url', 'filename', 'size', 'spoiler')
+    
+    def __init__(self, url: str, filename: str, size: int, spoiler: bool):
+        self.url = url
+        self.filename = filename
+        self.size = size
+        self.spoiler = spoiler
+    
+    def is_spoiler(self) -> bool:
+        return self.spoiler
+
+class AuthorRecord:
+    """
+    The parts of a message author shown on a copy
+    
+    Records are shared by every queued message from the same author (until
+    their name or avatar changes), so a busy poster is only stored once.
+    """
+    
+    __slots__ = ('id', 'bot', 'display_name', 'avatar_url', '__weakref__')
+    
+    _shared = weakref.WeakValueDictionary()  # author id -> AuthorRecord
+    
+    def __init__(self, author_id: int, bot: bool, display_name: str, avatar_url: str):
+        self.id = author_id
+        self.bot = bot
+        self.display_name = display_name
+        self.avatar_url = avatar_url
+    
+    @classmethod
+    def shared(cls, author) -> 'AuthorRecord':
+        """The record for a discord.User or Member, reusing the last one made for them"""
+        display_name = author.display_name
+        avatar_url = author.display_avatar.url
+        record = cls._shared.get(author.id)
+        if record is None or record.display_name != display_name or record.avatar_url != avatar_url:
+            record = cls(author.id, author.bot, display_name, avatar_url)
+            cls._shared[author.id] = record
+        return record
+
+class EmbedRecord:
+    """
+    The parts of a media embed that survive copying it
+    
+    Embeds the copy would leave out aren't kept at all. Of the rest only the
+    media URLs, type and text are kept: Discord regenerates proxy URLs,
+    sizes and the provider when the copy is sent.
+    """
+    
+    __slots__ = ('type', 'url', 'image', 'thumbnail', 'video', 'text')
+    
+    # Text parts of an embed kept as they are, if present
+    TEXT_KEYS = ('title', 'description', 'color', 'timestamp', 'author', 'footer', 'fields')
+    
+    def __init__(self, embed_type: str, url: Optional[str], image: Optional[str],
+                 thumbnail: Optional[str], video: Optional[str], text: Optional[dict]):
+        self.type = embed_type
+        self.url = url
+        self.image = image
+        self.thumbnail = thumbnail
+        self.video = video
+        self.text = text
+    
+    @classmethod
+    def from_embed(cls, embed: discord.Embed) -> Optional['EmbedRecord']:
+        """Record an embed, or None if copying would leave it out"""
+        if not (embed.image or embed.video or embed.thumbnail or embed.type in ('image', 'video', 'gifv')):
+            return None
+        url = embed.url
+        
+        def media_url(proxy):
+            # (The embed's own URL is often the media's too - keep one string)
+            return url if proxy.url == url else proxy.url
+        
+        data = embed.to_dict()
+        text = {key: data[key] for key in cls.TEXT_KEYS if key in data}
+        return cls(sys.intern(embed.type), url, media_url(embed.image), media_url(embed.thumbnail),
+                   media_url(embed.video), text or None)
+    
+    def to_embed(self) -> discord.Embed:
+        data = dict(self.text) if self.text else {}
+        data["type"] = self.type
+        if self.url:
+            data["url"] = self.url
+        for key in ("image", "thumbnail", "video"):
+            media = getattr(self, key)
+            if media:
+                data[key] = {"url": media}
+        return discord.Embed.from_dict(data)
+
+class MessageRecord:
+    """
+    Compact stand-in for a queued discord.Message
+    
+    Keeps only what copying reads - ids, the author's name and avatar, the
+    content, attachment metadata and the media embeds - so a queued message
+    doesn't hold its Message, Member, User, Attachment and Embed objects
+    alive while it waits. Attribute names match discord.Message, so the
+    filters and the copy path read either. The channel is the one in
+    discord.py's cache (not a copy); embeds are rebuilt when read, which
+    only happens when the message is checked and copied.
+    """
+    
+    __slots__ = ('id', 'channel', 'author', 'content', 'attachments', '_embeds')
+    
+    def __init__(self, message_id: int, channel, author: AuthorRecord, content: str,
+                 attachments: tuple, embeds: tuple):
+        self.id = message_id
+        self.channel = channel
+        self.author = author
+        self.content = content
+        self.attachments = attachments
+        self._embeds = embeds
+    
+    @classmethod
+    def from_message(cls, message) -> 'MessageRecord':
+        embeds = (EmbedRecord.from_embed(embed) for embed in message.embeds)
+        return cls(
+            message.id,
+            message.channel,
+            AuthorRecord.shared(message.author),
+            message.content,
+            tuple(AttachmentRecord(a.url, a.filename, a.size, a.is_spoiler()) for a in message.attachments),
+            tuple(embed for embed in embeds if embed is not None)
+        )
+    
+    @property
+    def guild(self):
+        return self.channel.guild
+    
+    @property
+    def created_at(self) -> datetime:
+        return discord.utils.snowflake_time(self.id)
+    
+    @property
+    def jump_url(self) -> str:
+        return f"https://discord.com/channels/{self.channel.guild.id}/{self.channel.id}/{self.id}"
+    
+    @property
+    def embeds(self) -> List[discord.Embed]:
+        return [embed.to_embed() for embed in self._embeds]
+
+class QueueItem:
+    """A queued message and its progress through the copy pipeline"""
+    
+    __slots__ = ('message', 'time', 'ready_at', 'embeds_loaded', 'dispatched')
+    
+    def __init__(self, message, queued_time: datetime, ready_at: float, embeds_loaded: bool):
+        self.message = message  # A MessageRecord (a PartialMessage while replaying, until refetched)
+        self.time = queued_time
+        self.ready_at = ready_at
+        self.embeds_loaded = embeds_loaded
+        self.dispatched = 0.0  # When handed to a destination lane (monotonic)
+
+class MessageQueue:
+    """
+    Message processing queue indexed by message ID
+    
+    Every item is in exactly one of three states, each an ordered dict keyed
+    by message ID:
+    - pending: waiting for its ready-at deadline (kept in arrival order)
+    - in_flight: handed to the copy stage
+    - done: recently finished, kept (bounded) so late duplicates are rejected
+    
+    Enqueue, dedup lookup and removal are O(1). Deadlines live in a heap of
+    (ready_at, seq, message_id); entries whose item has left the pending
+    state or been rescheduled are skipped lazily when they come due.
+    Unfinished items are also counted per guild, for the per-guild cap.
+    """
+    
+    def __init__(self, done_limit: int = 1000):
+        self.pending = OrderedDict()
+        self.in_flight = OrderedDict()
+        self.done = OrderedDict()
+        self.done_limit = done_limit
+        self.guild_counts: Dict[int, int] = {}
+        self._heap = []
+        self._seq = itertools.count()  # Tie-breaker so heap entries never compare ids
+    
+    def __len__(self) -> int:
+        """Number of items not yet finished (pending + in flight)"""
+        return len(self.pending) + len(self.in_flight)
+    
+    def __contains__(self, message_id: int) -> bool:
+        return message_id in self.pending or message_id in self.in_flight or message_id in self.done
+    
+    def guild_count(self, guild_id: int) -> int:
+        """Number of a guild's items not yet finished"""
+        return self.guild_counts.get(guild_id, 0)
+    
+    def push(self, message_id: int, item: QueueItem, ready_at: float) -> bool:
+        """Queue an item under its deadline. Returns True if it is now the earliest"""
+        self.pending[message_id] = item
+        guild_id = item.message.guild.id
+        self.guild_counts[guild_id] = self.guild_counts.get(guild_id, 0) + 1
+        heapq.heappush(self._heap, (ready_at, next(self._seq), message_id))
+        return self._heap[0][2] == message_id
+    
+    def next_ready_at(self) -> Optional[float]:
+        """Deadline of the earliest scheduled item, or None if nothing is scheduled"""
+        return self._heap[0][0] if self._heap else None
+    
+    def reschedule(self, message_id: int, ready_at: float) -> bool:
+        """Move a pending item's deadline. Returns True if it is now the earliest"""
+        item = self.pending.get(message_id)
+        if item is None:
+            return False
+        item.ready_at = ready_at
+        heapq.heappush(self._heap, (ready_at, next(self._seq), message_id))
+        return self._heap[0][2] == message_id
+    
+    def pop_due(self, now: float) -> List[QueueItem]:
+        """Move every pending item whose deadline has passed to in-flight"""
+        due = []
+        while self._heap and self._heap[0][0] <= now:
+            ready_at, _, message_id = heapq.heappop(self._heap)
+            item = self.pending.get(message_id)
+            if item is None or item.ready_at != ready_at:
+                continue  # Expired, already handed out or rescheduled
+            del self.pending[message_id]
+            self.in_flight[message_id] = item
+            due.append(item)
+        return due
+    
+    def complete(self, message_id: int):
+        """Mark an in-flight item as done"""
+        item = self.in_flight.pop(message_id, None)
+        if item is not None:
+            self._uncount(item)
+        self.done[message_id] = True
+        while len(self.done) > self.done_limit:
+            self.done.popitem(last=False)
+    
+    def expire(self, cutoff_time: datetime) -> List[QueueItem]:
+        """Drop pending items queued before cutoff_time. Returns the dropped items"""
+        dropped = []
+        while self.pending:
+            message_id, item = next(iter(self.pending.items()))
+            if item.time > cutoff_time:
+                break
+            del self.pending[message_id]
+            self._uncount(item)
+            dropped.append(item)
+        return dropped
+    
+    def drop_oldest(self, guild_id: int) -> Optional[QueueItem]:
+        """
+        Remove and return a guild's oldest pending item (None if it has none)
+        
+        A linear scan in arrival order - only used when shedding load, and
+        the flooding guild's items are then most of the queue.
+        """
+        for message_id, item in self.pending.items():
+            if item.message.guild.id == guild_id:
+                del self.pending[message_id]
+                self._uncount(item)
+                self.done[message_id] = True
+                return item
+        return None
+    
+    def _uncount(self, item: QueueItem):
+        guild_id = item.message.guild.id
+        count = self.guild_counts.get(guild_id, 0) - 1
+        if count > 0:
+            self.guild_counts[guild_id] = count
+        else:
+            self.guild_counts.pop(guild_id, None)
+
+class DedupStore:
+    """
+    Bounded record of message IDs that have been seen and/or copied
+    
+    Entries are kept in insertion order as message_id -> (timestamp, copied).
+    Expiry (older than ttl seconds) and eviction (over capacity) only ever pop
+    from the oldest end, so both are amortized O(1) and memory is capped at
+    capacity entries - the store is never rebuilt wholesale.
+    """
+    
+    def __init__(self, capacity: int = 20000, ttl: float = 1800):
+        self.capacity = capacity
+        self.ttl = ttl
+        self._entries = OrderedDict()
+    
+    def __len__(self) -> int:
+        return len(self._entries)
+    
+    def __contains__(self, message_id: int) -> bool:
+        entry = self._entries.get(message_id)
+        return entry is not None and time.monotonic() - entry[0] < self.ttl
+    
+    def add(self, message_id: int) -> bool:
+        """Record a message as seen. Returns False if it was already tracked"""
+        if message_id in self:
+            return False
+        self._insert(message_id, False)
+        return True
+    
+    def mark_copied(self, message_id: int):
+        """Record a message as copied, keeping its original position if tracked"""
+        entry = self._entries.get(message_id)
+        if entry is not None:
+            self._entries[message_id] = (entry[0], True)
+        else:
+            self._insert(message_id, True)
+    
+    def is_copied(self, message_id: int) -> bool:
+        """Check if a message has been copied within the ttl"""
+        entry = self._entries.get(message_id)
+        return entry is not None and entry[1] and time.monotonic() - entry[0] < self.ttl
+    
+    def expire(self) -> int:
+        """Drop entries older than ttl and any over capacity. Returns the number dropped"""
+        cutoff = time.monotonic() - self.ttl
+        dropped = 0
+        while self._entries:
+            _, (timestamp, _) = next(iter(self._entries.items()))
+            if timestamp > cutoff and len(self._entries) <= self.capacity:
+                break
+            self._entries.popitem(last=False)
+            dropped += 1
+        return dropped
+    
+    def _insert(self, message_id: int, copied: bool):
+        self._entries.pop(message_id, None)  # Re-adding an expired ID moves it to the end
+        self._entries[message_id] = (time.monotonic(), copied)
+        self.expire()
+
+class ByteBudget:
+    """
+    Global budget for attachment bytes held by in-flight copies
+    
+    Downloads reserve their size up front and wait (in FIFO order) while the
+    budget is exhausted, so memory and temp disk use stay capped no matter
+    how many media posts arrive at once. A single file larger than the whole
+    budget is clamped to it and proceeds alone.
+    """
+    
+    def __init__(self, limit: int):
+        self.limit = limit
+        self.in_use = 0
+        self.peak = 0
+        self._waiters = deque()
+    
+    async def acquire(self, nbytes: int) -> int:
+        """Reserve nbytes, waiting for room if needed. Returns the amount reserved"""
+        nbytes = min(nbytes, self.limit)
+        if not self._waiters and self.in_use + nbytes <= self.limit:
+            self._grant(nbytes)
+            return nbytes
+        
+        waiter = (nbytes, asyncio.get_running_loop().create_future())
+        self._waiters.append(waiter)
+        try:
+            await waiter[1]
+        except asyncio.CancelledError:
+            if waiter[1].done() and not waiter[1].cancelled():
+                self.release(nbytes)  # Granted just as we were cancelled
+            else:
+                if waiter in self._waiters:
+                    self._waiters.remove(waiter)
+                self._wake()
+            raise
+        return nbytes
+    
+    def release(self, nbytes: int):
+        """Return reserved bytes to the budget and wake waiters that now fit"""
+        if nbytes:
+            self.in_use -= nbytes
+            self._wake()
+    
+    def _grant(self, nbytes: int):
+        self.in_use += nbytes
+        self.peak = max(self.peak, self.in_use)
+    
+    def _wake(self):
+        while self._waiters:
+            nbytes, future = self._waiters[0]
+            if future.done():
+                self._waiters.popleft()  # Cancelled, its task cleans up
+                continue
+            if self.in_use + nbytes > self.limit:
+                break
+            self._waiters.popleft()
+            self._grant(nbytes)
+            future.set_result(None)
+
+class TokenBucket:
+    """
+    Send rate limit for one destination channel
+    
+    Starts from Discord's per-channel message limit (5 per 5 seconds) and is
+    resynchronised from the X-RateLimit headers of every send to that
+    channel, so workers wait only as long as Discord requires.
+    """
+    
+    def __init__(self, capacity: int = 5, period: float = 5.0):
+        self.capacity = capacity
+        self.rate = capacity / period  # tokens per second
+        self.tokens = float(capacity)
+        self.updated = time.monotonic()
+        self.blocked_until = 0.0
+    
+    async def acquire(self):
+        """Wait until a send is allowed and take a token"""
+        while True:
+            wait = self.delay()
+            if wait <= 0:
+                self.tokens -= 1
+                return
+            await asyncio.sleep(wait)
+    
+    def delay(self, sends: int = 1) -> float:
+        """Seconds until `sends` sends are allowed (0 if now), without taking a token"""
+        now = time.monotonic()
+        if now < self.blocked_until:
+            return self.blocked_until - now
+        self.tokens = min(self.capacity, self.tokens + (now - self.updated) * self.rate)
+        self.updated = now
+        return max(0.0, (min(sends, self.capacity) - self.tokens) / self.rate)
+    
+    def update(self, limit: int, remaining: int, reset_after: float):
+        """Sync with X-RateLimit-Limit/Remaining/Reset-After from a response"""
+        now = time.monotonic()
+        self.capacity = max(1, limit)
+        self.tokens = float(remaining)
+        self.updated = now
+        if remaining <= 0:
+            self.blocked_until = max(self.blocked_until, now + reset_after)
+    
+    def pause(self, retry_after: float):
+        """Block sends after a 429 for the Retry-After period"""
+        now = time.monotonic()
+        self.tokens = 0.0
+        self.updated = now
+        self.blocked_until = max(self.blocked_until, now + retry_after)
+
+class EmbedLatency:
+    """
+    Rolling estimate of how long each site's links take to unfurl
+    
+    Link posts are watched from when they are queued until an edit brings
+    their media embed - also when it comes after the bot stopped waiting,
+    so slow unfurls aren't cut off at the current wait - and the delays are
+    kept per site (the last `window`). A message waits for the `percentile`
+    delay of its slowest site, clamped to [floor, ceiling]; sites with fewer
+    than min_samples delays use their default (slow_sites, else
+    default_wait). Messages linking several sites aren't sampled, since the
+    edit doesn't say which link unfurled. Links that arrive already unfurled
+    count as a delay of 0; since those never wait, the percentile is taken
+    among the rest. At most max_sites sites are kept, least recently sampled
+    dropped first.
+    """
+    
+    def __init__(self, default_wait: float, slow_sites: Dict[str, float], floor: float = 1.0,
+                 ceiling: float = 15.0, percentile: float = 0.95, window: int = 100,
+                 min_samples: int = 10, max_sites: int = 500, watch_for: float = 60.0,
+                 max_watched: int = 10_000):
+        self.default_wait = default_wait
+        self.slow_sites = slow_sites
+        self.floor = floor
+        self.ceiling = ceiling
+        self.percentile = percentile
+        self.window = window
+        self.min_samples = min_samples
+        self.max_sites = max_sites
+        self.watch_for = watch_for
+        self.max_watched = max_watched
+        self._samples: OrderedDict = OrderedDict()  # site -> deque of delays (seconds)
+        self._waits: Dict[str, float] = {}  # site -> wait, until its next sample
+        self._watched: OrderedDict = OrderedDict()  # message_id -> (queued at (monotonic), site)
+    
+    def __contains__(self, message_id: int) -> bool:
+        return message_id in self._watched
+    
+    def wait_for(self, sites: Tuple[str, ...]) -> float:
+        """Seconds a message linking these sites should wait for its embeds"""
+        return max((self.site_wait(site) for site in sites), default=self.default_wait)
+    
+    def site_wait(self, site: str) -> float:
+        wait = self._waits.get(site)
+        if wait is None:
+            samples = self._samples.get(site)
+            if samples is None or len(samples) < self.min_samples:
+                return self.slow_sites.get(site, self.default_wait)
+            ordered = sorted(samples)
+            # e.g. with half unfurled on arrival, the 95th percentile of the rest is the 97.5th overall
+            unfurled = ordered.count(0.0) / len(ordered)
+            level = unfurled + self.percentile * (1 - unfurled)
+            wait = ordered[min(len(ordered) - 1, int(level * len(ordered)))]
+            wait = min(max(wait, self.floor), self.ceiling)
+            self._waits[site] = wait
+        return wait
+    
+    def watch(self, message_id: int, sites: Tuple[str, ...], now: float):
+        """Start timing a queued link post's unfurl"""
+        if len(sites) == 1:
+            self._watched[message_id] = (now, sites[0])
+        # Forget posts that never unfurled
+        while self._watched:
+            queued_at, _ = next(iter(self._watched.values()))
+            if len(self._watched) <= self.max_watched and now - queued_at <= self.watch_for:
+                break
+            self._watched.popitem(last=False)
+    
+    def forget(self, message_id: int):
+        """Stop watching a post, so its embed arriving later is ignored"""
+        self._watched.pop(message_id, None)
+    
+    def arrived(self, message_id: int, now: float) -> Optional[Tuple[str, float]]:
+        """Record that an edit brought a watched post's embed. Returns (site, delay)"""
+        watched = self._watched.pop(message_id, None)
+        if watched is None:
+            return None
+        queued_at, site = watched
+        delay = now - queued_at
+        self.observe(site, delay)
+        return site, delay
+    
+    def observe(self, site: str, delay: float):
+        """Add one unfurl delay for a site"""
+        samples = self._samples.pop(site, None)  # Re-added at the most recent end
+        if samples is None:
+            samples = deque(maxlen=self.window)
+        samples.append(delay)
+        self._samples[site] = samples
+        self._waits.pop(site, None)
+        while len(self._samples) > self.max_sites:
+            dropped, _ = self._samples.popitem(last=False)
+            self._waits.pop(dropped, None)
+
+class DownloadedAttachment:
+    """An attachment downloaded for copying, with its content hashes"""
+    
+    __slots__ = ('file', 'buffer', 'size', 'digest', 'phash')
+    
+    def __init__(self, file: discord.File, buffer, size: int, digest: str):
+        self.file = file
+        self.buffer = buffer
+        self.size = size
+        self.digest = digest  # SHA-256 of the bytes, hex
+        self.phash: Optional[str] = None  # dHash for images, hex
+    
+    def close(self):
+        """Close the buffer - discord.File stubs out its close() until File.close() puts it back"""
+        self.file.close()
+        self.buffer.close()
+
+class RecompressCache:
+    """
+    Recompressed images keyed by (content hash, size limit)
+    
+    An LRU bounded by total bytes, so an image reposted to several channels
+    (or retried) is only re-encoded once per limit.
+    """
+    
+    def __init__(self, max_bytes: int):
+        self.max_bytes = max_bytes
+        self.size = 0
+        self._entries = OrderedDict()  # (digest, limit) -> (bytes, filename)
+    
+    def get(self, key: tuple) -> Optional[tuple]:
+        entry = self._entries.get(key)
+        if entry is not None:
+            self._entries.move_to_end(key)
+        return entry
+    
+    def put(self, key: tuple, entry: tuple):
+        if len(entry[0]) > self.max_bytes or key in self._entries:
+            return
+        self._entries[key] = entry
+        self.size += len(entry[0])
+        while self.size > self.max_bytes:
+            _, (data, _) = self._entries.popitem(last=False)
+            self.size -= len(data)
+
+class JobPool:
+    """
+    Bounded background job runner (used for ffmpeg transcodes)
+    
+    Jobs wait in a queue of at most queue_size - submit refuses more rather
+    than blocking, so a burst of huge uploads can't pile up work or stall
+    the caller - and run on `workers` tasks, each job cancelled after
+    `timeout` seconds. Workers start on the first submit.
+    """
+    
+    def __init__(self, workers: int, queue_size: int, timeout: float):
+        self.workers = workers
+        self.timeout = timeout
+        self._queue = asyncio.Queue(maxsize=queue_size)
+        self._tasks: List[asyncio.Task] = []
+    
+    def __len__(self) -> int:
+        return self._queue.qsize()
+    
+    def submit(self, name: str, job: Callable, *args) -> bool:
+        """Queue job(*args), returning False if the queue is full"""
+        self._start()
+        try:
+            self._queue.put_nowait((name, job, args))
+        except asyncio.QueueFull:
+            return False
+        return True
+    
+    async def put(self, name: str, job: Callable, *args):
+        """Queue job(*args), waiting for room - for callers that feed a backlog"""
+        self._start()
+        await self._queue.put((name, job, args))
+    
+    def _start(self):
+        if not self._tasks:
+            self._tasks = [asyncio.create_task(self._worker()) for _ in range(self.workers)]
+    
+    async def close(self):
+        for task in self._tasks:
+            task.cancel()
+        await asyncio.gather(*self._tasks, return_exceptions=True)
+        self._tasks = []
+    
+    async def _worker(self):
+        while True:
+            name, job, args = await self._queue.get()
+            try:
+                await asyncio.wait_for(job(*args), self.timeout)
+            except asyncio.TimeoutError:
+                logger.warning(f"Job {name} timed out after {self.timeout}s")
+            except Exception as e:
+                logger.error(f"Job {name} failed: {e}")
+
+class MediaIndex:
+    """
+    Per-guild index of media already copied, keyed by content hash
+    
+    Entries (guild, SHA-256, perceptual hash, link to the copy) live in a
+    SQLite file, pruned to max_per_guild rows per guild oldest first, with
+    an LRU of hot entries in memory. All SQLite work runs on one background
+    thread so lookups never block the event loop.
+    """
+    
+    def __init__(self, path: str, max_per_guild: int = 5000, hot_entries: int = 2048):
+        self.path = path
+        self.max_per_guild = max_per_guild
+        self.hot_entries = hot_entries
+        self._hot = OrderedDict()  # (guild_id, SHA-256) -> (jump_url, created)
+        self._executor = ThreadPoolExecutor(max_workers=1, thread_name_prefix="media-index")
+        self._conn = None
+        self._inserts = 0
+    
+    async def lookup(self, guild_id: int, digest: str, phash: Optional[str],
+                     window: float) -> Optional[Tuple[str, bool]]:
+        """
+        Find an earlier copy of this media within window seconds
+        
+        Returns (link to the copy, exact) - exact if the file itself was
+        copied, False if only a similar-looking image (same perceptual hash).
+        """
+        cutoff = time.time() - window
+        entry = self._hot.get((guild_id, digest))
+        if entry is not None:
+            self._hot.move_to_end((guild_id, digest))
+            if entry[1] >= cutoff:
+                return entry[0], True
+        
+        row = await self._run(self._lookup_row, guild_id, digest, phash, cutoff)
+        if row is None:
+            return None
+        jump_url, created, exact = row
+        if exact:
+            self._remember(guild_id, digest, jump_url, created)
+        return jump_url, exact
+    
+    async def record(self, guild_id: int, digest: str, phash: Optional[str], jump_url: str):
+        """Remember that this media has been copied to jump_url"""
+        created = time.time()
+        self._remember(guild_id, digest, jump_url, created)
+        await self._run(self._insert_row, guild_id, digest, phash, jump_url, created)
+    
+    def close(self):
+        self._executor.shutdown(wait=True)
+        if self._conn is not None:
+            self._conn.close()
+    
+    def _remember(self, guild_id, digest, jump_url, created):
+        # Only exact hashes - a perceptual hit here could hide an exact match in SQLite
+        self._hot[(guild_id, digest)] = (jump_url, created)
+        self._hot.move_to_end((guild_id, digest))
+        while len(self._hot) > self.hot_entries:
+            self._hot.popitem(last=False)
+    
+    async def _run(self, func, *args):
+        return await asyncio.get_running_loop().run_in_executor(self._executor, func, *args)
+    
+    def _connection(self) -> sqlite3.Connection:
+        if self._conn is None:
+            self._conn = sqlite3.connect(self.path, timeout=30, check_same_thread=False)
+            self._conn.execute("PRAGMA journal_mode=WAL")
+            self._conn.execute(
+                "CREATE TABLE IF NOT EXISTS media ("
+                "guild_id INTEGER, digest TEXT, phash TEXT, jump_url TEXT, created REAL, "
+                "PRIMARY KEY (guild_id, digest))"
+            )
+            self._conn.execute("CREATE INDEX IF NOT EXISTS media_phash ON media (guild_id, phash)")
+            self._conn.execute("CREATE INDEX IF NOT EXISTS media_created ON media (guild_id, created)")
+        return self._conn
+    
+    def _lookup_row(self, guild_id, digest, phash, cutoff):
+        conn = self._connection()
+        row = conn.execute(
+            "SELECT jump_url, created FROM media WHERE guild_id = ? AND digest = ? AND created >= ?",
+            (guild_id, digest, cutoff)
+        ).fetchone()
+        if row is not None:
+            return row[0], row[1], True
+        if phash:
+            row = conn.execute(
+                "SELECT jump_url, created FROM media WHERE guild_id = ? AND phash = ? AND created >= ? "
+                "ORDER BY created LIMIT 1",
+                (guild_id, phash, cutoff)
+            ).fetchone()
+            if row is not None:
+                return row[0], row[1], False
+        return None
+    
+    def _insert_row(self, guild_id, digest, phash, jump_url, created):
+        conn = self._connection()
+        with conn:
+            conn.execute(
+                # Copied again after the window - point at the new copy and restart its window
+                "INSERT INTO media VALUES (?, ?, ?, ?, ?) ON CONFLICT (guild_id, digest) "
+                "DO UPDATE SET phash = excluded.phash, jump_url = excluded.jump_url, created = excluded.created",
+                (guild_id, digest, phash, jump_url, created)
+            )
+            # Prune every so often rather than on every insert
+            self._inserts += 1
+            if self._inserts % 100 == 0:
+                conn.execute(
+                    "DELETE FROM media WHERE guild_id = ? AND created < ("
+                    "SELECT created FROM media WHERE guild_id = ? ORDER BY created DESC LIMIT 1 OFFSET ?)",
+                    (guild_id, guild_id, self.max_per_guild - 1)
+                )
+
+class QueueJournal:
+    """
+    Crash-safe record of queued messages in a SQLite WAL database
+    
+    One row per message: (message_id, channel_id, state, queued_at, updated)
+    with state pending, copied or skipped. Recording an event only appends
+    to an in-memory batch; the batch is committed in one transaction
+    commit_interval seconds later on a background thread (group commit),
+    so a crash loses at most that window. Rows older than retention
+    seconds are pruned.
+    """
+    
+    def __init__(self, path: str, commit_interval: float = 0.05, retention: float = 1800):
+        self.path = path
+        self.commit_interval = commit_interval
+        self.retention = retention
+        self._batch = []
+        self._flush_handle = None
+        self._executor = ThreadPoolExecutor(max_workers=1, thread_name_prefix="queue-journal")
+        self._conn = None
+        self._commits = 0
+    
+    def load(self, max_pending_age: float):
+        """
+        Read the journal at startup
+        
+        Returns (pending, copied): (message_id, channel_id, queued_at) of
+        messages queued within max_pending_age seconds that never finished,
+        and the ids of messages copied within retention seconds.
+        """
+        now = time.time()
+        conn = self._connection()
+        with conn:
+            conn.execute("DELETE FROM journal WHERE updated < ?", (now - self.retention,))
+        pending = conn.execute(
+            "SELECT message_id, channel_id, queued_at FROM journal "
+            "WHERE state = 'pending' AND queued_at >= ? ORDER BY message_id",
+            (now - max_pending_age,)
+        ).fetchall()
+        copied = [row[0] for row in conn.execute(
+            "SELECT message_id FROM journal WHERE state = 'copied' ORDER BY updated"
+        )]
+        return pending, copied
+    
+    def queued(self, message_id: int, channel_id: int):
+        self._append(message_id, channel_id, "pending")
+    
+    def finished(self, message_id: int, channel_id: int, copied: bool):
+        self._append(message_id, channel_id, "copied" if copied else "skipped")
+    
+    def close(self):
+        if self._flush_handle is not None:
+            self._flush_handle.cancel()
+            self._flush_handle = None
+        if self._batch:
+            batch, self._batch = self._batch, []
+            self._executor.submit(self._write, batch).result()
+        self._executor.shutdown(wait=True)
+        if self._conn is not None:
+            self._conn.close()
+    
+    def _append(self, message_id: int, channel_id: int, state: str):
+        now = time.time()
+        self._batch.append((message_id, channel_id, state, now, now))
+        if self._flush_handle is None:
+            self._flush_handle = asyncio.get_running_loop().call_later(self.commit_interval, self._flush)
+    
+    def _flush(self):
+        self._flush_handle = None
+        batch, self._batch = self._batch, []
+        future = self._executor.submit(self._write, batch)
+        future.add_done_callback(self._log_write_error)
+    
+    @staticmethod
+    def _log_write_error(future):
+        error = future.exception()
+        if error is not None:
+            logger.error(f"Error writing queue journal: {error}")
+    
+    def _connection(self) -> sqlite3.Connection:
+        if self._conn is None:
+            self._conn = sqlite3.connect(self.path, timeout=30, check_same_thread=False)
+            self._conn.execute("PRAGMA journal_mode=WAL")
+            self._conn.execute("PRAGMA synchronous=NORMAL")  # WAL stays consistent; fsync at checkpoints
+            self._conn.execute(
+                "CREATE TABLE IF NOT EXISTS journal ("
+                "message_id INTEGER PRIMARY KEY, channel_id INTEGER, state TEXT, queued_at REAL, updated REAL)"
+            )
+            self._conn.execute("CREATE INDEX IF NOT EXISTS journal_updated ON journal (updated)")
+        return self._conn
+    
+    def _write(self, batch: list):
+        conn = self._connection()
+        with conn:
+            conn.executemany(
+                "INSERT INTO journal VALUES (?, ?, ?, ?, ?) ON CONFLICT (message_id) "
+                "DO UPDATE SET state = excluded.state, updated = excluded.updated",
+                batch
+            )
+            # Prune every so often rather than on every commit
+            self._commits += 1
+            if self._commits % 1000 == 0:
+                conn.execute("DELETE FROM journal WHERE updated < ?", (time.time() - self.retention,))
+
+class JsonConfigBackend:
+    """Whole config in one JSON file, replaced atomically on every flush"""
+    
+    def __init__(self, path: str):
+        self.path = path
+    
+    def load(self) -> Optional[Dict[str, Any]]:
+        if not os.path.exists(self.path):
+            return None
+        try:
+            with open(self.path, 'r') as f:
+                return json.load(f)
+        except json.JSONDecodeError:
+            logger.error("Invalid JSON in config file, creating new config")
+            return None
+    
+    def snapshot(self, config: Dict[str, Any], guild_ids: Optional[Set[str]]) -> str:
+        """Serialize on the event loop so the worker thread never sees a half-made change"""
+        return json.dumps(config, indent=4)
+    
+    def write(self, payload: str):
+        # Write to a temp file and rename over the old one, so a crash mid-write
+        # leaves the previous config intact
+        temp_path = f"{self.path}.tmp"
+        with open(temp_path, 'w') as f:
+            f.write(payload)
+            f.flush()
+            os.fsync(f.fileno())
+        os.replace(temp_path, self.path)
+
+class SqliteConfigBackend:
+    """
+    Config stored as one row per (section, guild) in a SQLite WAL database
+    
+    A change to one guild only rewrites that guild's rows, and rows are never
+    dropped wholesale, so cluster processes can share the database (each only
+    writes the guilds on its own shards). On first use the existing JSON
+    config file, if any, is imported.
+    """
+    
+    def __init__(self, path: str, import_path: Optional[str] = None):
+        self.path = path
+        self.import_path = import_path
+    
+    def _connect(self) -> sqlite3.Connection:
+        conn = sqlite3.connect(self.path, timeout=30)
+        conn.execute("PRAGMA journal_mode=WAL")
+        conn.execute(
+            "CREATE TABLE IF NOT EXISTS config ("
+            "section TEXT, guild_id TEXT, value TEXT, PRIMARY KEY (section, guild_id))"
+        )
+        return conn
+    
+    def load(self) -> Optional[Dict[str, Any]]:
+        conn = self._connect()
+        try:
+            rows = conn.execute("SELECT section, guild_id, value FROM config").fetchall()
+        finally:
+            conn.close()
+        
+        if not rows:
+            if self.import_path:
+                config = JsonConfigBackend(self.import_path).load()
+                if config is not None:
+                    logger.info(f"Imported {self.import_path} into {self.path}")
+                    self.write(self.snapshot(config, None))
+                    return config
+            return None
+        
+        config = {section: {} for section in CONFIG_SECTIONS}
+        for section, guild_id, value in rows:
+            config.setdefault(section, {})[guild_id] = json.loads(value)
+        return config
+    
+    def snapshot(self, config: Dict[str, Any], guild_ids: Optional[Set[str]]):
+        """Rows to upsert (value) or delete (None) - every row when guild_ids is None"""
+        if guild_ids is None:
+            return [(section, guild_id, json.dumps(value))
+                    for section, values in config.items()
+                    for guild_id, value in values.items()]
+        rows = []
+        for section, values in config.items():
+            for guild_id in guild_ids:
+                rows.append((section, guild_id, json.dumps(values[guild_id]) if guild_id in values else None))
+        return rows
+    
+    def write(self, rows):
+        conn = self._connect()
+        try:
+            with conn:
+                conn.executemany(
+                    "DELETE FROM config WHERE section = ? AND guild_id = ?",
+                    [(section, guild_id) for section, guild_id, value in rows if value is None]
+                )
+                conn.executemany(
+                    "INSERT OR REPLACE INTO config VALUES (?, ?, ?)",
+                    [row for row in rows if row[2] is not None]
+                )
+        finally:
+            conn.close()
+
+class ConfigStore:
+    """
+    In-memory config with debounced, off-loop persistence
+    
+    Changes are made to `data` directly and announced with mark_dirty(guild_id).
+    Bursts of changes are merged and flushed once, `debounce` seconds after the
+    first, by a single worker thread (so writes stay in order). Outside a
+    running event loop, changes are written immediately.
+    """
+    
+    def __init__(self, backend, debounce: float = 1.0):
+        self.backend = backend
+        self.debounce = debounce
+        self.data: Dict[str, Any] = {}
+        self._dirty: Optional[Set[str]] = set()  # None means the whole config
+        self._flush_handle = None
+        self._executor = ThreadPoolExecutor(max_workers=1, thread_name_prefix="config-store")
+    
+    def load(self) -> Optional[Dict[str, Any]]:
+        return self.backend.load()
+    
+    def mark_dirty(self, *guild_ids: str):
+        """Schedule a flush of these guilds' settings (no guild_ids = everything)"""
+        if not guild_ids:
+            self._dirty = None
+        elif self._dirty is not None:
+            self._dirty.update(guild_ids)
+        
+        try:
+            loop = asyncio.get_running_loop()
+        except RuntimeError:
+            self.flush_now()
+            return
+        if self._flush_handle is None:
+            self._flush_handle = loop.call_later(self.debounce, self._flush_in_background)
+    
+    def flush_now(self):
+        """Write pending changes from the calling thread (startup and shutdown)"""
+        if self._flush_handle is not None:
+            self._flush_handle.cancel()
+            self._flush_handle = None
+        payload = self._take_snapshot()
+        if payload is not None:
+            self._executor.submit(self.backend.write, payload).result()
+    
+    def close(self):
+        self.flush_now()
+        self._executor.shutdown(wait=True)
+    
+    def _take_snapshot(self):
+        dirty = self._dirty
+        self._dirty = set()
+        if dirty is not None and not dirty:
+            return None
+        return self.backend.snapshot(self.data, dirty)
+    
+    def _flush_in_background(self):
+        self._flush_handle = None
+        payload = self._take_snapshot()
+        if payload is None:
+            return
+        future = self._executor.submit(self.backend.write, payload)
+        future.add_done_callback(self._log_write_error)
+    
+    @staticmethod
+    def _log_write_error(future):
+        error = future.exception()
+        if error is not None:
+            logger.error(f"Error saving config: {error}")
+
+class Metrics:
+    """
+    Counters, gauges and histograms exported in the Prometheus text format
+    
+    Metrics are declared once with counter/histogram/gauge and then updated
+    by name. Each metric keeps at most max_series label combinations; any
+    more (e.g. guilds past the first few hundred) are counted under "other".
+    Gauges are read from a callback when the endpoint is scraped.
+    """
+    
+    def __init__(self, max_series: int = 200):
+        self.max_series = max_series
+        self._meta: Dict[str, tuple] = {}  # name -> (type, help, buckets or callback)
+        self._series: Dict[str, Dict[tuple, Any]] = {}
+    
+    def counter(self, name: str, help_text: str):
+        self._meta[name] = ("counter", help_text, None)
+        self._series[name] = {}
+    
+    def histogram(self, name: str, help_text: str, buckets: tuple):
+        self._meta[name] = ("histogram", help_text, buckets)
+        self._series[name] = {}
+    
+    def gauge(self, name: str, help_text: str, read: Callable[[], Any], kind: str = "gauge",
+              label: Optional[str] = None):
+        """A gauge read when scraped - with label, read returns {label value: value}"""
+        self._meta[name] = (kind, help_text, (read, label))
+    
+    def inc(self, name: str, amount: float = 1, **labels):
+        series = self._series[name]
+        key = self._key(series, labels)
+        series[key] = series.get(key, 0) + amount
+    
+    def observe(self, name: str, value: float, **labels):
+        series = self._series[name]
+        key = self._key(series, labels)
+        buckets = self._meta[name][2]
+        entry = series.get(key)
+        if entry is None:
+            entry = series[key] = [[0] * len(buckets), 0.0, 0]  # per-bucket counts, sum, count
+        for index, bound in enumerate(buckets):
+            if value <= bound:
+                entry[0][index] += 1
+                break
+        entry[1] += value
+        entry[2] += 1
+    
+    def render(self) -> str:
+        lines = []
+        for name, (kind, help_text, extra) in self._meta.items():
+            lines.append(f"# HELP {name} {help_text}")
+            lines.append(f"# TYPE {name} {kind}")
+            if kind == "histogram":
+                for key, (counts, total, count) in self._series[name].items():
+                    cumulative = 0
+                    for bound, bucket_count in zip(extra, counts):
+                        cumulative += bucket_count
+                        lines.append(f"{name}_bucket{self._labels(key + (('le', bound),))} {cumulative}")
+                    lines.append(f"{name}_bucket{self._labels(key + (('le', '+Inf'),))} {count}")
+                    lines.append(f"{name}_sum{self._labels(key)} {total}")
+                    lines.append(f"{name}_count{self._labels(key)} {count}")
+            elif name in self._series:
+                for key, value in self._series[name].items():
+                    lines.append(f"{name}{self._labels(key)} {value}")
+            else:
+                read, label = extra
+                if label is None:
+                    lines.append(f"{name} {read()}")
+                    continue
+                values = read()
+                for value in itertools.islice(values, self.max_series):
+                    lines.append(f"{name}{self._labels(((label, value),))} {values[value]}")
+        return "\n".join(lines) + "\n"
+    
+    def _key(self, series: Dict[tuple, Any], labels: Dict[str, Any]) -> tuple:
+        key = tuple(sorted(labels.items()))
+        if key not in series and len(series) >= self.max_series:
+            key = tuple((label, "other") for label, _ in key)
+        return key
+    
+    @staticmethod
+    def _labels(key: tuple) -> str:
+        if not key:
+            return ""
+        pairs = []
+        for label, value in key:
+            value = str(value).replace('\\', '\\\\').replace('"', '\\"').replace('\n', '\\n')
+            pairs.append(f'{label}="{value}"')
+        return "{" + ",".join(pairs) + "}"
+
+class GuildRoute:
+    """
+    Compiled routing settings for one guild
+    
+    Built from the raw JSON config by build_routes() so that routing a
+    message takes a couple of hash lookups on int IDs.
+    """
+    
+    __slots__ = ('media_channel_id', 'monitor_all', 'monitored', 'excluded', 'include_author', 'duplicate_mode')
+    
+    def __init__(self, media_channel_id: int, monitor_all: bool, monitored: frozenset,
+                 excluded: frozenset, include_author: bool, duplicate_mode: str):
+        self.media_channel_id = media_channel_id
+        self.monitor_all = monitor_all
+        self.monitored = monitored
+        self.excluded = excluded
+        self.include_author = include_author
+        self.duplicate_mode = duplicate_mode
+    
+    def accepts(self, channel_id: int) -> bool:
+        """Check if media from this channel should be copied"""
+        # Don't copy from the media channel itself
+        if channel_id == self.media_channel_id:
+            return False
+        if self.monitor_all:
+            # Monitor all channels except media channel and excluded channels
+            return channel_id not in self.excluded
+        return channel_id in self.monitored
+
+def build_routes(config: Dict[str, Any]) -> types.MappingProxyType:
+    """Compile the config into a read-only guild_id (int) -> GuildRoute table"""
+    routes = {}
+    for guild_id, monitored in config["monitored_channels"].items():
+        media_channel_id = config["media_channels"].get(guild_id)
+        if not media_channel_id:
+            continue  # Nowhere to copy to
+        routes[int(guild_id)] = GuildRoute(
+            media_channel_id=media_channel_id,
+            monitor_all=config["monitor_all"].get(guild_id, False),
+            monitored=frozenset(monitored),
+            excluded=frozenset(config["excluded_channels"].get(guild_id, [])),
+            include_author=config["include_author"].get(guild_id, True),
+            duplicate_mode=config["duplicate_media"].get(guild_id, "skip")
+        )
+    return types.MappingProxyType(routes)
+
+class BackfillJob:
+    """Progress of one guild's running /backfill"""
+    
+    __slots__ = ('guild_id', 'scanned', 'queued', 'skipped', 'task', 'progress_message')
+    
+    def __init__(self, guild_id: int, progress_message=None):
+        self.guild_id = guild_id
+        self.scanned = 0  # messages read from history
+        self.queued = 0  # messages handed to the copy workers
+        self.skipped = 0  # channels whose history couldn't be read
+        self.task: Optional[asyncio.Task] = None
+        self.progress_message = progress_message
+
+class MediaCopyBot(BotBase):
     def __init__(self):
         # Set up intents - required for discord.py v2.x
-        intents = discord.Intents.default()
+        cache_options = {}
+        if GATEWAY_PROFILE == "lean":
+            intents = discord.Intents.none()
+            intents.guild_messages = True  # Message creates and edits (embed unfurls)
+            cache_options = {
+                "max_messages": None,
+                "member_cache_flags": discord.MemberCacheFlags.none(),
+                "chunk_guilds_at_startup": False
+            }
+        else:
+            intents = discord.Intents.default()
         intents.message_content = True  # Required for reading message content
-        intents.guilds = True  # Required for guild operations
+        intents.guilds = True  # Required for guild operations (channels, roles, guild.me)
+        
+        # Watch Discord's responses so send rate limits come from its headers
+        http_trace = aiohttp.TraceConfig()
+        http_trace.on_request_end.append(self._on_discord_response)
+        
+        # Fixed shard layout when sharded (otherwise AutoShardedBot asks Discord)
+        shard_options = {}
+        if SHARD_COUNT and SHARD_COUNT.lower() != "auto":
+            shard_options["shard_count"] = int(SHARD_COUNT)
+            if SHARD_IDS:
+                shard_options["shard_ids"] = [int(shard_id) for shard_id in SHARD_IDS.split(",")]
         
         super().__init__(
-            command_prefix="!",  # Keep prefix for backup, but primarily use slash commands
+            command_prefix=COMMAND_PREFIX,  # Keep prefix for backup, but primarily use slash commands
             intents=intents,
-            help_command=None
+            help_command=None,
+            http_trace=http_trace,
+            **cache_options,
+            **shard_options
         )
         
-        # Load configuration
+        # Load configuration - kept in memory, persisted on a debounce from a
+        # worker thread (CONFIG_BACKEND=sqlite stores one row per guild setting)
+        if os.getenv("CONFIG_BACKEND", "json").lower() == "sqlite":
+            backend = SqliteConfigBackend(CONFIG_DB_FILE, import_path=CONFIG_FILE)
+        else:
+            backend = JsonConfigBackend(CONFIG_FILE)
+        self.config_store = ConfigStore(backend, debounce=1.0)
         self.config = self.load_config()
         
+        # Routing table compiled from the config, swapped whole on every change
+        self.routes = build_routes(self.config)
+        
         # Add event for when the bot is ready to sync commands
         self.setup_hook_ran = False
         
-        # Keep track of recently processed message IDs to prevent multi-posting
-        # Using a dict to store both the message ID and the timestamp
-        self.recently_processed = {}
+        # Keep track of seen and copied message IDs to prevent multi-posting
+        # Bounded by capacity and ttl (seconds), oldest entries expire first
+        self.processed_messages = DedupStore(capacity=20000, ttl=1800)
+        
+        # Message processing queue - indexed by message ID and scheduled by
+        # deadline, so the batch processor sleeps until the earliest ready_at
+        # instead of rescanning the whole queue on a timer
+        self.message_queue = MessageQueue()
         
-        # Track message IDs that have been successfully copied
-        self.copied_messages = set()
+        # Load shedding - at most queue_limit messages queued, guild_queue_limit
+        # per guild. At a cap, drop-oldest in OVERLOAD_POLICY sheds the oldest
+        # waiting message of the guild over its cap (or of the busiest guild),
+        # otherwise the new message is refused. From degrade_high queued
+        # messages until back down to degrade_low the bot runs degraded: link
+        # posts whose embed never arrived are not refetched (skip-refetch) and
+        # oversized media is left out of copies (skip-oversize), deferred -
+        # up to deferred_limit files - to follow once degraded mode ends
+        self.queue_limit = int(os.getenv("QUEUE_LIMIT", "5000"))
+        self.guild_queue_limit = int(os.getenv("GUILD_QUEUE_LIMIT", "1000"))
+        self.overload_policy = {
+            action.strip() for action in
+            os.getenv("OVERLOAD_POLICY", "drop-oldest,skip-refetch,skip-oversize").split(",")
+            if action.strip()
+        }
+        self.degrade_high = int(self.queue_limit * 0.8)
+        self.degrade_low = int(self.queue_limit * 0.5)
+        self.degraded = False
+        self.shed_counts: Dict[str, int] = {}  # since the last summary in the log
+        self.deferred_oversize: deque = deque()  # (attachment, message, media channel, size limit)
+        self.deferred_limit = 200
+        self.deferred_task: Optional[asyncio.Task] = None
         
-        # Message processing queue - stores all messages for batch processing
-        self.message_queue = []
+        # Queue journal - messages still pending at the last shutdown or crash
+        # are replayed once connected, and recently copied ones stay deduped
+        self.journal = QueueJournal(QUEUE_JOURNAL_FILE, retention=self.processed_messages.ttl)
+        self.journal_pending, copied = self.journal.load(max_pending_age=300)
+        for message_id in copied:
+            self.processed_messages.mark_copied(message_id)
         self.queue_lock = asyncio.Lock()  # Lock for thread-safe queue operations
+        self.queue_wakeup = asyncio.Event()
         
         # Batch processing settings
-        self.batch_delay = 5  # seconds between batch processing
+        self.batch_delay = 5  # max seconds to sleep while the queue is empty
+        self.embed_wait = 3  # seconds to wait for embeds before copying
+        self.twitter_embed_wait = 8  # Twitter embeds take longer to load
+        # Per-site embed waits learned from how long links actually take to
+        # unfurl; the two waits above are the defaults until a site has data
+        self.embed_latency = EmbedLatency(self.embed_wait, {"twitter.com": self.twitter_embed_wait})
+        # Link posts whose embed arrived while they were being refetched or
+        # copied without it - copied again if that attempt comes to nothing
+        self.late_unfurls: Dict[int, MessageRecord] = {}
         self.processing_batch = False
         
+        # Attachment download settings - one pooled session shared by all copies
+        self.download_session: Optional[aiohttp.ClientSession] = None
+        self.download_concurrency = 8  # downloads in flight across all messages
+        self.download_concurrency_per_message = 4  # downloads in flight per message
+        self.download_timeout = 30  # seconds per attachment
+        self.download_retries = 3  # retries on 5xx/429 and connection errors
+        self.download_backoff = 0.5  # seconds, doubled after each retry
+        self.download_semaphore = asyncio.Semaphore(self.download_concurrency)
+        
+        # Downloads stream into memory below spool_threshold and into temp files
+        # above it; download_budget caps the bytes held by all in-flight copies
+        self.spool_threshold = 1024 * 1024
+        self.download_budget = ByteBudget(64 * 1024 * 1024)
+        
+        # Images over the destination's upload limit are re-encoded to fit in
+        # a process pool (created on first use), with results cached by hash
+        self.image_pool: Optional[ProcessPoolExecutor] = None
+        self.image_workers = min(2, os.cpu_count() or 1)
+        self.recompress_max_source = 50 * 1024 * 1024  # larger images are not worth downloading
+        self.recompress_cache = RecompressCache(32 * 1024 * 1024)
+        
+        # Videos and GIFs over the upload limit are transcoded to MP4 by ffmpeg
+        # (when installed, unless TRANSCODE=off) and posted as a follow-up,
+        # so the copy itself never waits for them
+        transcode = os.getenv("TRANSCODE", "on").lower() not in ("0", "off", "false")
+        self.ffmpeg = shutil.which("ffmpeg") if transcode else None
+        self.ffprobe = shutil.which("ffprobe") if transcode else None
+        self.transcode_max_source = 200 * 1024 * 1024  # bytes
+        self.transcode_threads = 2  # ffmpeg threads per job
+        self.transcode_pool = JobPool(
+            workers=max(1, (os.cpu_count() or 1) // (2 * self.transcode_threads)),
+            queue_size=8,
+            timeout=300
+        )
+        
+        # Copy workers - due messages are queued in a lane per destination channel,
+        # lanes with work wait in ready_lanes, and each destination has its own
+        # send token bucket fed by Discord's rate-limit headers
+        self.copy_workers = 4
+        self.copy_lanes: Dict[int, deque] = {}
+        self.active_lanes: Set[int] = set()
+        self.ready_lanes = asyncio.Queue()
+        self.parked_lanes: Dict[int, asyncio.TimerHandle] = {}
+        # The batch processor, copy workers and other long-running tasks,
+        # stopped first on close - copies already under way get up to
+        # shutdown_grace seconds to finish, so their sends are journaled
+        self.pipeline_tasks: List[asyncio.Task] = []
+        self.copies_underway: Set[asyncio.Task] = set()
+        self.shutdown_grace = 10.0
+        self.send_buckets: Dict[int, TokenBucket] = {}
+        
+        # Fair scheduling between guilds - deficit round-robin over the lanes:
+        # each turn a lane earns lane_quantum x its guild's weight in credit and
+        # spends it on messages costing 1 + their attachment count, so a flood
+        # of heavy posts in one server can't take more than its share of the
+        # workers. GUILD_WEIGHTS="guild_id:weight,..." raises (or lowers) some
+        # servers' share, e.g. a premium tier; with GUILD_WEIGHT_BY_SIZE=on the
+        # rest are weighted by log10 of their member count
+        self.lane_quantum = 4
+        self.lane_deficits: Dict[int, float] = {}
+        self.guild_weights = parse_guild_weights(os.getenv("GUILD_WEIGHTS", ""))
+        self.weight_by_size = os.getenv("GUILD_WEIGHT_BY_SIZE", "off").lower() in ("1", "on", "true")
+        
+        # Uploads from the same author and channel arriving within this many
+        # seconds of each other are merged into one copy (0 disables) - while a
+        # burst may still grow its lane is parked, not holding a worker
+        self.coalesce_window = 1.5
+        
+        # Backfills of channel history - channels paged at once per guild, and
+        # how many backfilled messages may wait in a destination's lane (so
+        # memory stays flat and live messages never queue behind a backlog)
+        self.backfills: Dict[int, BackfillJob] = {}
+        self.backfill_concurrency = 3
+        self.backfill_backlog = 10
+        self.backfills_resumed = False
+        # Source ids already copied, read from a media channel's jump links -
+        # at most backfill_scan_limit copies, and kept (media channel id ->
+        # (newest copy read, ids)) so a resumed backfill only reads newer ones
+        self.backfill_scan_limit = 5000
+        self.backfill_copied: Dict[int, Tuple[int, Set[int]]] = {}
+        
+        # Background refetches of link posts (batched per channel)
+        self.refresh_tasks: Set[asyncio.Task] = set()
+        self.refetch_calls_saved = 0
+        
+        # Content-hash index of copied media, so the same file posted in several
+        # channels is only uploaded once per duplicate_window (seconds)
+        self.media_index = MediaIndex(MEDIA_INDEX_FILE)
+        self.duplicate_window = 7 * 24 * 3600
+        
+        # Cluster mode - status reports go to the launcher through status_queue
+        self.cluster_id = int(CLUSTER_ID) if CLUSTER_ID else None
+        self.status_queue = None  # Set by run_cluster
+        self.status_interval = 30  # seconds between status reports
+        
+        # Metrics - served in the Prometheus text format on METRICS_PORT when
+        # set (cluster n listens on METRICS_PORT + n)
+        self.metrics = Metrics()
+        self.metrics_host = os.getenv("METRICS_HOST", "127.0.0.1")
+        self.metrics_port = int(os.getenv("METRICS_PORT", "0"))
+        if self.metrics_port and self.cluster_id:
+            self.metrics_port += self.cluster_id
+        self.metrics_runner: Optional[web.AppRunner] = None
+        self.loop_lag_interval = 0.5  # seconds between event loop lag samples
+        self._declare_metrics()
+        
     def load_config(self) -> Dict[str, Any]:
-        """Load configuration from JSON file"""
-        if os.path.exists(CONFIG_FILE):
-            try:
-                with open(CONFIG_FILE, 'r') as f:
-                    config = json.load(f)
-                    
-                # Migration: Add excluded_channels if missing
-                if "excluded_channels" not in config:
-                    config["excluded_channels"] = {}
-                    logger.info("Added excluded_channels to existing config")
-                    self.save_config(config)
+        """Load configuration from the config store"""
+        config = self.config_store.load()
+        if config is not None:
+            self.config_store.data = config
+            
+            # Migration: Add sections (e.g. excluded_channels) missing from older configs
+            for section in CONFIG_SECTIONS:
+                if section not in config:
+                    config[section] = {}
+                    logger.info(f"Added {section} to existing config")
+                    self.config_store.mark_dirty()
                     
-                return config
-            except json.JSONDecodeError:
-                logger.error("Invalid JSON in config file, creating new config")
+            return config
         
         # Default configuration
         default_config = {
@@ -79,19 +1675,25 @@ class MediaCopyBot(commands.Bot):
             "media_channels": {},      # guild_id: channel_id
             "include_author": {},      # guild_id: boolean
             "monitor_all": {},         # guild_id: boolean
-            "excluded_channels": {}    # guild_id: [channel_ids] - excluded when monitor_all is True
+            "excluded_channels": {},   # guild_id: [channel_ids] - excluded when monitor_all is True
+            "duplicate_media": {},     # guild_id: "skip" | "link" | "off"
+            "backfill": {}             # guild_id: {"after": id, "channels": {channel_id: last id}} while running
         }
         
-        self.save_config(default_config)
+        self.config_store.data = default_config
+        self.config_store.mark_dirty()
         return default_config
     
-    def save_config(self, config: Dict[str, Any] = None):
-        """Save configuration to JSON file"""
-        if config is None:
-            config = self.config
+    def save_config(self, *guild_ids: str):
+        """
+        Apply config changes and schedule them to be saved
         
-        with open(CONFIG_FILE, 'w') as f:
-            json.dump(config, f, indent=4)
+        Pass the IDs of the guilds whose settings changed so only those are
+        rewritten (with the SQLite backend); no IDs saves everything.
+        """
+        # Recompile routing for the change being saved
+        self.routes = build_routes(self.config)
+        self.config_store.mark_dirty(*guild_ids)
     
     async def setup_hook(self):
         """Called when the bot is first setting up before login"""
@@ -100,8 +1702,10 @@ class MediaCopyBot(commands.Bot):
             # This sync can take time, so it's important to only do it once during startup
             try:
                 # Global sync to make commands available in all guilds
-                await self.tree.sync()
-                logger.info("Commands synced globally!")
+                # (clusters share one application, so only the first syncs)
+                if not self.cluster_id:
+                    await self.tree.sync()
+                    logger.info("Commands synced globally!")
                 
                 # Also sync to each guild for immediate updates
                 for guild in self.guilds:
@@ -112,29 +1716,191 @@ class MediaCopyBot(commands.Bot):
                 
             self.setup_hook_ran = True
             
-            # Start the batch processing task
-            self.loop.create_task(self._batch_processor())
+            # Start the batch processing task and the copy workers
+            self.pipeline_tasks.append(self.loop.create_task(self._batch_processor()))
+            for _ in range(self.copy_workers):
+                self.pipeline_tasks.append(self.loop.create_task(self._copy_worker()))
+            
+            if self.status_queue is not None:
+                self.pipeline_tasks.append(self.loop.create_task(self._status_reporter()))
+            
+            if self.metrics_port:
+                await self._start_metrics_server()
+        
+    async def close(self):
+        """Stop copying, then close the download session and Discord connection"""
+        self.report_status("stopped")
+        # Nothing may write to the journal or config once they close - an
+        # interrupted copy stays pending in the journal and is replayed
+        tasks = [*self.pipeline_tasks, *self.refresh_tasks]
+        if self.deferred_task is not None:
+            tasks.append(self.deferred_task)
+        tasks.extend(job.task for job in self.backfills.values() if job.task is not None)
+        for task in tasks:
+            task.cancel()
+        await asyncio.gather(*tasks, return_exceptions=True)
+        self.pipeline_tasks = []
+        if self.copies_underway:
+            _, unfinished = await asyncio.wait(self.copies_underway, timeout=self.shutdown_grace)
+            for task in unfinished:
+                task.cancel()
+            await asyncio.gather(*unfinished, return_exceptions=True)
+        for handle in self.parked_lanes.values():
+            handle.cancel()
+        self.parked_lanes.clear()
+        
+        if self.metrics_runner is not None:
+            await self.metrics_runner.cleanup()
+        if self.download_session is not None and not self.download_session.closed:
+            await self.download_session.close()
+        if self.image_pool is not None:
+            self.image_pool.shutdown(wait=False)
+        await self.transcode_pool.close()
+        await super().close()
+        # (Gateway events can still queue messages until the connection closes)
+        self.media_index.close()
+        self.config_store.close()
+        self.journal.close()
+    
+    def report_status(self, state: str):
+        """Send this cluster's status to the launcher (no-op outside a cluster)"""
+        if self.status_queue is None:
+            return
+        latency = self.latency
+        self.status_queue.put({
+            "cluster": self.cluster_id,
+            "shards": SHARD_IDS,
+            "state": state,
+            "guilds": len(self.guilds),
+            "queued": len(self.message_queue),
+            "latency_ms": round(latency * 1000) if math.isfinite(latency) else None
+        })
+    
+    async def _status_reporter(self):
+        """Report this cluster's status every status_interval seconds"""
+        await self.wait_until_ready()
+        while not self.is_closed():
+            await asyncio.sleep(self.status_interval)
+            self.report_status("running")
+    
+    def _declare_metrics(self):
+        """Declare the metrics exported on the metrics endpoint"""
+        metrics = self.metrics
+        metrics.counter("mediabot_messages_queued_total", "Messages queued for copying, by guild")
+        metrics.counter("mediabot_messages_copied_total", "Messages copied, by guild")
+        metrics.histogram("mediabot_copy_latency_seconds",
+                          "Time from a message being queued to its copy being sent, by guild", LATENCY_BUCKETS)
+        metrics.histogram("mediabot_wait_overshoot_seconds",
+                          "How long after their ready time queued messages were dispatched", OVERSHOOT_BUCKETS)
+        metrics.histogram("mediabot_embed_latency_seconds",
+                          "Time from a link post being queued to its media embed arriving, by site", LATENCY_BUCKETS)
+        metrics.counter("mediabot_embeds_after_wait_total",
+                        "Media embeds that arrived after their message's embed wait ran out, by site")
+        metrics.counter("mediabot_discord_requests_total",
+                        "Discord REST requests by route (send, fetch_message, history, other) and status")
+        metrics.counter("mediabot_download_bytes_total", "Attachment bytes downloaded")
+        metrics.counter("mediabot_upload_bytes_total", "Attachment bytes uploaded, by guild")
+        metrics.counter("mediabot_download_retries_total", "Attachment download retries, by reason")
+        metrics.counter("mediabot_duplicates_total", "Attachments not uploaded again because they were copied before, by guild")
+        metrics.counter("mediabot_messages_shed_total",
+                        "Messages dropped or degraded under load, by reason and guild")
+        metrics.gauge("mediabot_degraded", "1 while the bot is shedding load", lambda: int(self.degraded))
+        metrics.counter("mediabot_transcodes_total", "Oversized video/GIF transcodes by result")
+        metrics.gauge("mediabot_transcode_queue", "Transcode jobs waiting for a worker",
+                      lambda: len(self.transcode_pool))
+        metrics.histogram("mediabot_event_loop_lag_seconds", "How late the event loop ran a timer", OVERSHOOT_BUCKETS)
+        metrics.gauge("mediabot_queue_depth", "Messages waiting for their embeds or a copy",
+                      lambda: len(self.message_queue))
+        metrics.gauge("mediabot_copy_backlog", "Messages waiting in destination lanes for a copy worker",
+                      lambda: sum(len(lane) for lane in self.copy_lanes.values()))
+        metrics.gauge("mediabot_lane_depth", "Messages waiting for a copy worker, by guild",
+                      lambda: {lane[0].message.guild.id: len(lane) for lane in self.copy_lanes.values() if lane},
+                      label="guild")
+        metrics.histogram("mediabot_lane_wait_seconds",
+                          "Time messages waited in their destination lane for a copy worker, by guild", LATENCY_BUCKETS)
+        metrics.gauge("mediabot_download_buffer_bytes", "Bytes reserved by in-flight downloads",
+                      lambda: self.download_budget.in_use)
+        metrics.gauge("mediabot_refetch_calls_saved_total", "REST calls saved by refetching link posts per channel",
+                      lambda: self.refetch_calls_saved, kind="counter")
+    
+    async def _start_metrics_server(self):
+        """Serve the metrics on http://metrics_host:metrics_port/metrics"""
+        async def handle_metrics(request):
+            return web.Response(text=self.metrics.render(), content_type="text/plain", charset="utf-8")
+        
+        app = web.Application()
+        app.router.add_get("/metrics", handle_metrics)
+        self.metrics_runner = web.AppRunner(app, access_log=None)
+        await self.metrics_runner.setup()
+        try:
+            await web.TCPSite(self.metrics_runner, self.metrics_host, self.metrics_port).start()
+        except OSError as e:
+            logger.error(f"Could not start metrics endpoint on port {self.metrics_port}: {e}")
+            return
+        self.pipeline_tasks.append(self.loop.create_task(self._loop_lag_monitor()))
+        logger.info(f"Metrics available at http://{self.metrics_host}:{self.metrics_port}/metrics")
+    
+    async def _loop_lag_monitor(self):
+        """Sample event loop lag - how much later than asked a short sleep wakes up"""
+        while not self.is_closed():
+            started = time.monotonic()
+            await asyncio.sleep(self.loop_lag_interval)
+            lag = time.monotonic() - started - self.loop_lag_interval
+            self.metrics.observe("mediabot_event_loop_lag_seconds", max(lag, 0))
+    
+    def _get_download_session(self) -> aiohttp.ClientSession:
+        """Return the shared download session, creating it on first use"""
+        if self.download_session is None or self.download_session.closed:
+            connector = aiohttp.TCPConnector(
+                limit=self.download_concurrency,
+                limit_per_host=self.download_concurrency,  # Attachments all come from Discord's CDN
+                ttl_dns_cache=300,
+                keepalive_timeout=60
+            )
+            self.download_session = aiohttp.ClientSession(
+                connector=connector,
+                timeout=aiohttp.ClientTimeout(total=self.download_timeout, sock_connect=10)
+            )
+        return self.download_session
         
     async def on_ready(self):
         """Event handler for when the bot is ready"""
         logger.info(f"{self.user} has connected to Discord!")
         logger.info(f"Bot is in {len(self.guilds)} guilds")
         
-        # Initialize config for all guilds
+        # Initialize config for new guilds - reconnects with nothing new write nothing
+        defaults = {
+            "monitored_channels": [],
+            "media_channels": None,
+            "include_author": True,
+            "monitor_all": False,
+            "excluded_channels": [],
+            "duplicate_media": "skip"
+        }
+        new_guilds = set()
         for guild in self.guilds:
             guild_id = str(guild.id)
-            if guild_id not in self.config["monitored_channels"]:
-                self.config["monitored_channels"][guild_id] = []
-            if guild_id not in self.config["media_channels"]:
-                self.config["media_channels"][guild_id] = None
-            if guild_id not in self.config["include_author"]:
-                self.config["include_author"][guild_id] = True
-            if guild_id not in self.config["monitor_all"]:
-                self.config["monitor_all"][guild_id] = False
-            if guild_id not in self.config["excluded_channels"]:
-                self.config["excluded_channels"][guild_id] = []
-        
-        self.save_config()
+            for section, default in defaults.items():
+                if guild_id not in self.config[section]:
+                    self.config[section][guild_id] = copy.copy(default)
+                    new_guilds.add(guild_id)
+        
+        if new_guilds:
+            self.save_config(*new_guilds)
+        
+        # Pick up where the last run left off (once - on_ready also fires after reconnects)
+        if self.journal_pending:
+            pending, self.journal_pending = self.journal_pending, []
+            self.pipeline_tasks.append(self.loop.create_task(self._replay_journal(pending)))
+        if not self.backfills_resumed:
+            self.backfills_resumed = True
+            for guild_id in list(self.config["backfill"]):
+                guild = self.get_guild(int(guild_id))
+                if guild is not None:
+                    logger.info(f"Resuming backfill in {guild.name}")
+                    self.start_backfill(guild)
+        
+        self.report_status("ready")
         
         # Set bot status
         await self.change_presence(
@@ -150,183 +1916,842 @@ class MediaCopyBot(commands.Bot):
         if message.author.bot:
             return
         
+        # Process commands first and immediately - only messages with the
+        # prefix can be commands, so only those pay for a full context parse
+        if message.content.startswith(COMMAND_PREFIX):
+            ctx = await self.get_context(message)
+            if ctx.valid:  # If this is a valid command, only process it as a command
+                # Prevent multi-processing the same message
+                if not self.processed_messages.add(message.id):
+                    return
+                try:
+                    await self.process_commands(message)
+                except Exception as e:
+                    logger.error(f"Error processing command: {e}")
+                return
+        
+        # Cheap pre-filter so plain chat and unrouted channels never reach
+        # the queue or the dedup store
+        if not self._may_be_copied(message):
+            return
+        
         # Prevent multi-processing the same message
-        if message.id in self.recently_processed:
+        if not self.processed_messages.add(message.id):
             return
+        current_time = datetime.now()
+        
+        # For non-command messages, add to the processing queue
+        async with self.queue_lock:
+            # Check if message is already in queue (and there is room for it)
+            if message.id not in self.message_queue and self._make_room(message.guild.id):
+                # File the message under the time its embeds should have loaded.
+                # Links are usually marked ready earlier by on_raw_message_edit;
+                # the wait is only the fallback. Uploads have nothing to wait for,
+                # nor links Discord unfurled from its cache before sending the message.
+                sites = link_sites(message.content)
+                now = time.monotonic()
+                if sites:
+                    embedded = self._embedded_sites(message)
+                    embeds_loaded = embedded.issuperset(sites)
+                    if embeds_loaded:
+                        for site in sites:
+                            self.embed_latency.observe(site, 0.0)
+                            self.metrics.observe("mediabot_embed_latency_seconds", 0.0, site=site)
+                else:
+                    embeds_loaded = self.has_media_content(message)
+                if embeds_loaded:
+                    wait_seconds = 0
+                else:
+                    wait_seconds = self.embed_latency.wait_for(sites)
+                    self.embed_latency.watch(message.id, sites, now)
+                ready_at = now + wait_seconds
+                
+                item = QueueItem(MessageRecord.from_message(message), current_time, ready_at, embeds_loaded)
+                
+                # Wake the batch processor if this is now the earliest deadline
+                if self.message_queue.push(message.id, item, ready_at):
+                    self.queue_wakeup.set()
+                self.journal.queued(message.id, message.channel.id)
+                self.metrics.inc("mediabot_messages_queued_total", guild=message.guild.id)
+                self._update_load_state()
+                logger.debug(f"Added message {message.id} to queue. Queue size: {len(self.message_queue)}")
+    
+    async def on_raw_message_edit(self, payload):
+        """Mark a queued message ready as soon as Discord attaches a media embed"""
+        item = self.message_queue.pending.get(payload.message_id)
+        if item is None and payload.message_id not in self.embed_latency:
+            return
+        
+        # Link unfurls arrive as message updates carrying the new embeds
+        message = payload.message
+        if not any(self._is_media_embed(embed) for embed in message.embeds):
+            return
+        
+        observed = self.embed_latency.arrived(payload.message_id, time.monotonic())
+        if observed is not None:
+            site, delay = observed
+            self.metrics.observe("mediabot_embed_latency_seconds", delay, site=site)
+            if item is None:
+                # The wait ran out first
+                self.metrics.inc("mediabot_embeds_after_wait_total", site=site)
+                await self._copy_late_unfurl(MessageRecord.from_message(message))
+        if item is None:
+            return
+        
+        item.message = MessageRecord.from_message(message)
+        item.embeds_loaded = True
+        async with self.queue_lock:
+            if self.message_queue.reschedule(payload.message_id, time.monotonic()):
+                self.queue_wakeup.set()
+        logger.debug(f"Embeds loaded for queued message {payload.message_id}")
+    
+    async def _copy_late_unfurl(self, record: MessageRecord):
+        """Copy a link post whose embed arrived after the bot stopped waiting, unless it was copied anyway"""
+        message_id = record.id
+        if self.processed_messages.is_copied(message_id) or self._shedding("skip-refetch"):
+            return
+        if message_id in self.message_queue.in_flight:
+            # Its refetch may still catch the embed - decided once that copy attempt finishes
+            self.late_unfurls[message_id] = record
+        elif message_id in self.message_queue.done:
+            self.journal.queued(message_id, record.channel.id)
+            await self._dispatch([QueueItem(record, datetime.now(), 0, True)])
+    
+    def _may_be_copied(self, message) -> bool:
+        """
+        Fast pre-filter run on every incoming message
+        
+        True if the channel is routed and the message has a media attachment,
+        an embed, or a link that may unfurl into one. The full check in
+        should_copy_message runs again once embeds have had time to load.
+        """
+        if not message.guild:
+            return False
+        route = self.routes.get(message.guild.id)
+        if route is None or not route.accepts(message.channel.id):
+            return False
+        return bool(
+            self._has_media_attachment(message)
+            or message.embeds
+            or (message.content and URL_PATTERN.search(message.content))
+        )
+    
+    def _cleanup_message_tracking(self):
+        """Clean up message tracking collections"""
+        # Only pops expired entries off the oldest end of the store
+        self.processed_messages.expire()
+    
+    def _seconds_until_next_due(self) -> float:
+        """Seconds until the earliest queued message is ready (0 if one is due)"""
+        ready_at = self.message_queue.next_ready_at()
+        if ready_at is None:
+            return self.batch_delay
+        return max(0.0, ready_at - time.monotonic())
+    
+    async def _batch_processor(self):
+        """Process queued messages as soon as their deadlines come due"""
+        await self.wait_until_ready()
+        while not self.is_closed():
+            try:
+                # Sleep until the next deadline, or until an earlier one is queued
+                timeout = self._seconds_until_next_due()
+                if timeout > 0:
+                    self.queue_wakeup.clear()
+                    try:
+                        await asyncio.wait_for(self.queue_wakeup.wait(), timeout)
+                    except asyncio.TimeoutError:
+                        pass
+                    continue
+                
+                # Set processing flag
+                self.processing_batch = True
+                
+                # Process messages in the queue
+                await self._process_queued_messages()
+                
+                # Reset processing flag
+                self.processing_batch = False
+                
+            except Exception as e:
+                logger.error(f"Error in batch processor: {e}")
+    
+    async def _process_queued_messages(self):
+        """Process all messages in the queue whose deadline has passed"""
+        # Skip if nothing is scheduled
+        if self.message_queue.next_ready_at() is None:
+            return
+            
+        # Get current time for cleanup
+        current_time = datetime.now()
+        cutoff_time = current_time - timedelta(minutes=5)
+        
+        # Move only the due items to in-flight
+        now = time.monotonic()
+        async with self.queue_lock:
+            processing_queue = self.message_queue.pop_due(now)
+        for item in processing_queue:
+            self.metrics.observe("mediabot_wait_overshoot_seconds", max(now - item.ready_at, 0))
+        
+        # Links whose embed never arrived through an edit event get one last
+        # look via the API, batched per channel in the background; everything
+        # else goes straight to the copy workers
+        ready = []
+        stale = []
+        for item in processing_queue:
+            if item.embeds_loaded or not URL_PATTERN.search(item.message.content):
+                ready.append(item)
+            else:
+                stale.append(item)
+        if stale and self._shedding("skip-refetch"):
+            # Degraded: no REST calls for embeds that never arrived
+            for item in stale:
+                if self.has_media_content(item.message):
+                    ready.append(item)
+                else:
+                    async with self.queue_lock:
+                        self.message_queue.complete(item.message.id)
+                    self._shed(item, "refetch_skipped")
+            stale = []
+        await self._dispatch(ready)
+        if stale:
+            task = asyncio.create_task(self._refresh_and_dispatch(stale))
+            self.refresh_tasks.add(task)
+            task.add_done_callback(self.refresh_tasks.discard)
+        
+        # Clean up the queue - drop messages that have waited too long
+        async with self.queue_lock:
+            expired = self.message_queue.expire(cutoff_time)
+        for item in expired:
+            self._shed(item, "expired")
+        self._update_load_state()
+        if self.shed_counts:
+            summary = ", ".join(f"{count} {reason}" for reason, count in self.shed_counts.items())
+            logger.warning(f"Shed messages under load: {summary}. Queue size now: {len(self.message_queue)}")
+            self.shed_counts = {}
+            
+        # Clean up tracking
+        self._cleanup_message_tracking()
+            
+        if processing_queue:
+            logger.info(
+                f"Batch dispatched {len(processing_queue)} messages to {len(self.active_lanes)} destinations. "
+                f"Queue size now: {len(self.message_queue)}"
+            )
+            peak_rss = peak_rss_bytes() or 0
+            logger.debug(
+                f"Download buffer peak: {self.download_budget.peak / 2**20:.1f} MB, "
+                f"peak RSS: {peak_rss / 2**20:.1f} MB"
+            )
+    
+    def _make_room(self, guild_id: int) -> bool:
+        """
+        Enforce the queue caps before queueing a message from guild_id
+        
+        Returns whether it may be queued - at a cap only if drop-oldest shed
+        an older message to make room. Called with queue_lock held.
+        """
+        if self.message_queue.guild_count(guild_id) >= self.guild_queue_limit:
+            victim = guild_id
+        elif len(self.message_queue) >= self.queue_limit:
+            counts = self.message_queue.guild_counts
+            victim = max(counts, key=counts.get)
+        else:
+            return True
+        
+        if "drop-oldest" in self.overload_policy:
+            item = self._drop_oldest(victim)
+            if item is not None:
+                self._shed(item, "dropped_oldest")
+                return True
+        self._count_shed("queue_full", guild_id)
+        return False
+    
+    def _drop_oldest(self, guild_id: int) -> Optional[QueueItem]:
+        """Remove a guild's oldest message waiting for a copy worker, or else for its embeds"""
+        route = self.routes.get(guild_id)
+        lane = self.copy_lanes.get(route.media_channel_id) if route else None
+        # (Backfilled messages in the lane aren't counted against the caps)
+        if lane and lane[0].message.id in self.message_queue.in_flight:
+            item = lane.popleft()
+            self.message_queue.complete(item.message.id)
+            return item
+        return self.message_queue.drop_oldest(guild_id)
+    
+    def _shed(self, item: QueueItem, reason: str):
+        """Finish a queued message that was dropped under load"""
+        message = item.message
+        # (Nor copied when its embed turns up after all - only posts that
+        # finished normally get a late copy)
+        self.late_unfurls.pop(message.id, None)
+        self.embed_latency.forget(message.id)
+        self.journal.finished(message.id, message.channel.id, copied=False)
+        self._count_shed(reason, message.guild.id)
+    
+    def _count_shed(self, reason: str, guild_id: int):
+        self.metrics.inc("mediabot_messages_shed_total", reason=reason, guild=guild_id)
+        self.shed_counts[reason] = self.shed_counts.get(reason, 0) + 1
+    
+    def _update_load_state(self):
+        """Enter or leave degraded mode (with hysteresis, so it doesn't flap)"""
+        depth = len(self.message_queue)
+        if not self.degraded and depth >= self.degrade_high:
+            self.degraded = True
+            logger.warning(f"Queue at {depth} messages - degraded mode on ({', '.join(sorted(self.overload_policy))})")
+        elif self.degraded and depth <= self.degrade_low:
+            self.degraded = False
+            logger.info(f"Queue down to {depth} messages - degraded mode off")
+            if self.deferred_oversize and (self.deferred_task is None or self.deferred_task.done()):
+                self.deferred_task = asyncio.ensure_future(self._post_deferred())
+    
+    def _shedding(self, action: str) -> bool:
+        """Whether an overload policy action is in effect"""
+        return self.degraded and action in self.overload_policy
+    
+    def _defer_oversized(self, oversized: list, media_channel, size_limit: int):
+        """Keep (attachment, message) pairs left out of a degraded copy for _post_deferred"""
+        for attachment, message in oversized:
+            if not (self._can_recompress(attachment) or (self.ffmpeg and self._can_transcode(attachment))):
+                continue  # Left out in any case
+            if len(self.deferred_oversize) >= self.deferred_limit:
+                self._count_shed("oversize_skipped", message.guild.id)
+                continue
+            self.deferred_oversize.append((attachment, message, media_channel, size_limit))
+            self._count_shed("oversize_deferred", message.guild.id)
+    
+    async def _post_deferred(self):
+        """Re-encode and post the oversized media deferred in degraded mode, unless it starts again"""
+        logger.info(f"Posting {len(self.deferred_oversize)} deferred oversized files")
+        while self.deferred_oversize and not self.degraded:
+            attachment, message, media_channel, size_limit = self.deferred_oversize.popleft()
+            if self._can_recompress(attachment):
+                job = self._recompress_and_send
+            else:
+                job = self._transcode_and_send
+                self.metrics.inc("mediabot_transcodes_total", result="queued")
+            await self.transcode_pool.put(attachment.filename, job, attachment, message, media_channel, size_limit)
+    
+    async def _dispatch(self, items: List[QueueItem]):
+        """Hand each message to the worker lane of its destination channel"""
+        for item in items:
+            message = item.message
+            route = self.routes.get(message.guild.id) if message.guild else None
+            if route is None:
+                # Nowhere to copy to
+                async with self.queue_lock:
+                    self.message_queue.complete(message.id)
+                self.journal.finished(message.id, message.channel.id, copied=False)
+                continue
+            
+            media_channel_id = route.media_channel_id
+            item.dispatched = time.monotonic()
+            self.copy_lanes.setdefault(media_channel_id, deque()).append(item)
+            if media_channel_id not in self.active_lanes:
+                self.active_lanes.add(media_channel_id)
+                self.ready_lanes.put_nowait(media_channel_id)
+            elif media_channel_id in self.parked_lanes:
+                # The new message may join or close the burst the lane waits on
+                self.parked_lanes.pop(media_channel_id).cancel()
+                self.ready_lanes.put_nowait(media_channel_id)
+    
+    async def _refresh_and_dispatch(self, items: List[QueueItem]):
+        """Refetch queued messages grouped by channel, then dispatch them"""
+        by_channel: Dict[int, List[QueueItem]] = {}
+        for item in items:
+            by_channel.setdefault(item.message.channel.id, []).append(item)
+        
+        try:
+            calls = await asyncio.gather(
+                *(self._refresh_channel(channel_id, group) for channel_id, group in by_channel.items())
+            )
+            saved = len(items) - sum(calls)
+            self.refetch_calls_saved += saved
+            logger.debug(
+                f"Refetched {len(items)} messages in {len(by_channel)} channels "
+                f"with {sum(calls)} REST calls ({saved} saved)"
+            )
+        except Exception as e:
+            # If we can't fetch the messages, use the original ones
+            logger.error(f"Error refetching queued messages: {e}")
+        finally:
+            await self._dispatch(items)
+    
+    async def _refresh_channel(self, channel_id: int, items: List[QueueItem]) -> int:
+        """
+        Replace queued messages from one channel with fresh copies
+        
+        Several messages are covered by one history page starting just before
+        the oldest of them; ids the page misses (more than a page of chat in
+        between, or deleted) fall back to fetch_message. Returns the number
+        of REST calls made.
+        """
+        channel = self.get_channel(channel_id)
+        if channel is None:
+            return 0
+        
+        wanted = {item.message.id: item for item in items}
+        calls = 0
+        if len(wanted) > 1:
+            newest_id = max(wanted)
+            calls += 1
+            try:
+                after = discord.Object(id=min(wanted) - 1)
+                async for fresh in channel.history(limit=100, after=after, oldest_first=True):
+                    item = wanted.pop(fresh.id, None)
+                    if item is not None:
+                        item.message = MessageRecord.from_message(fresh)
+                    if not wanted or fresh.id >= newest_id:
+                        break
+            except discord.HTTPException as e:
+                logger.debug(f"Could not read history of channel {channel_id}: {e}")
+        
+        for message_id, item in wanted.items():
+            calls += 1
+            try:
+                item.message = MessageRecord.from_message(await channel.fetch_message(message_id))
+            except discord.HTTPException as e:
+                # If we can't fetch the message, use the original one
+                logger.debug(f"Could not fetch fresh message: {e}")
+        return calls
+    
+    async def _replay_journal(self, pending: list):
+        """
+        Requeue messages the journal shows were still pending at the last stop
+        
+        They are refetched (batched per channel) so their embeds are current,
+        then queued as ready. Channels this process can't see (another
+        cluster's, or deleted) are left to whoever can.
+        """
+        by_channel: Dict[int, List[QueueItem]] = {}
+        for message_id, channel_id, queued_at in pending:
+            channel = self.get_channel(channel_id)
+            if channel is None:
+                continue
+            # A placeholder until refetched
+            placeholder = channel.get_partial_message(message_id)
+            by_channel.setdefault(channel_id, []).append(
+                QueueItem(placeholder, datetime.fromtimestamp(queued_at), 0, True)
+            )
+        
+        replayed = 0
+        for channel_id, items in by_channel.items():
+            try:
+                await self._refresh_channel(channel_id, items)
+            except Exception as e:
+                logger.error(f"Error replaying queued messages from channel {channel_id}: {e}")
+            
+            for item in items:
+                message = item.message
+                # Deleted since (still the placeholder), no longer copyable, or already handled
+                if (type(message) is discord.PartialMessage or not self._may_be_copied(message)
+                        or not self.processed_messages.add(message.id)):
+                    self.journal.finished(message.id, channel_id, copied=False)
+                    continue
+                async with self.queue_lock:
+                    item.ready_at = time.monotonic()
+                    if self.message_queue.push(message.id, item, item.ready_at):
+                        self.queue_wakeup.set()
+                replayed += 1
+        
+        if replayed:
+            logger.info(f"Replayed {replayed} queued messages from the journal")
+    
+    def start_backfill(self, guild, channel_ids: Optional[List[int]] = None, days: int = 30,
+                       progress_message=None) -> BackfillJob:
+        """
+        Start copying media from the history of monitored channels
         
-        # Add to tracking collections with current timestamp
-        current_time = datetime.now()
-        self.recently_processed[message.id] = current_time
+        Resumes from the guild's checkpoint if a backfill was interrupted;
+        otherwise covers channel_ids (default: every channel being monitored)
+        back to `days` ago.
+        """
+        guild_id = str(guild.id)
+        if guild_id not in self.config["backfill"]:
+            route = self.routes.get(guild.id)
+            if channel_ids is None:
+                channel_ids = [channel.id for channel in guild.text_channels if route and route.accepts(channel.id)]
+            after = discord.utils.time_snowflake(discord.utils.utcnow() - timedelta(days=days))
+            self.config["backfill"][guild_id] = {
+                "after": after,
+                "channels": {str(channel_id): after for channel_id in channel_ids}
+            }
+            self.save_config(guild_id)
         
-        # Process commands first and immediately
-        ctx = await self.get_context(message)
-        if ctx.valid:  # If this is a valid command, only process it as a command
+        job = BackfillJob(guild.id, progress_message)
+        job.task = self.loop.create_task(self._run_backfill(job))
+        self.backfills[guild.id] = job
+        return job
+    
+    def backfill_embed(self, job: BackfillJob, title: str) -> discord.Embed:
+        """Progress report for a backfill"""
+        remaining = len(self.config["backfill"].get(str(job.guild_id), {}).get("channels", {}))
+        embed = discord.Embed(title=title, color=0x0099ff)
+        embed.add_field(name="Messages Scanned", value=str(job.scanned), inline=True)
+        embed.add_field(name="Queued for Copying", value=str(job.queued), inline=True)
+        embed.add_field(name="Channels Left", value=str(remaining), inline=True)
+        if job.skipped:
+            embed.add_field(name="Channels Skipped", value=f"{job.skipped} (no access)", inline=True)
+        return embed
+    
+    async def _run_backfill(self, job: BackfillJob):
+        """Page through each channel's history (a few channels at a time) and feed the copy workers"""
+        guild_id = str(job.guild_id)
+        state = self.config["backfill"][guild_id]
+        reporter = self.loop.create_task(self._report_backfill(job)) if job.progress_message else None
+        try:
+            route = self.routes.get(job.guild_id)
+            media_channel = self.get_channel(route.media_channel_id) if route else None
+            if media_channel is None:
+                logger.warning(f"Backfill for guild {guild_id} stopped: no media channel")
+                return
+            
+            copied = await self._copied_source_ids(media_channel, state["after"])
+            channel_limit = asyncio.Semaphore(self.backfill_concurrency)
+            channels = [
+                asyncio.ensure_future(
+                    self._backfill_channel(job, int(channel_id), media_channel.id, copied, channel_limit)
+                )
+                for channel_id in list(state["channels"])
+            ]
             try:
-                await self.process_commands(message)
-            except Exception as e:
-                logger.error(f"Error processing command: {e}")
-            return
+                await asyncio.gather(*channels)
+            except BaseException:
+                # Don't leave the other channels dispatching for a job that's over
+                for channel in channels:
+                    channel.cancel()
+                await asyncio.gather(*channels, return_exceptions=True)
+                raise
+            
+            del self.config["backfill"][guild_id]
+            self.save_config(guild_id)
+            self.backfill_copied.pop(media_channel.id, None)
+            logger.info(f"Backfill for guild {guild_id} done: scanned {job.scanned}, queued {job.queued}")
+            if job.progress_message:
+                await job.progress_message.edit(embed=self.backfill_embed(job, "✅ Backfill Complete"))
+        except asyncio.CancelledError:
+            # The checkpoint stays, so /backfill start resumes from here
+            self.config_store.mark_dirty(guild_id)
+            raise
+        except Exception as e:
+            # The checkpoint stays for /backfill start to retry
+            logger.error(f"Backfill for guild {guild_id} failed: {e}")
+            if reporter is not None:
+                reporter.cancel()
+            if job.progress_message:
+                embed = self.backfill_embed(job, "❌ Backfill Failed")
+                embed.description = f"{e}\nUse `/backfill start` to retry"
+                try:
+                    await job.progress_message.edit(embed=embed)
+                except discord.HTTPException as edit_error:
+                    logger.debug(f"Could not update backfill progress: {edit_error}")
+        finally:
+            if reporter is not None:
+                reporter.cancel()
+            if self.backfills.get(job.guild_id) is job:
+                del self.backfills[job.guild_id]
+    
+    async def _backfill_channel(self, job: BackfillJob, channel_id: int, media_channel_id: int,
+                                copied: Set[int], channel_limit: asyncio.Semaphore):
+        """Copy one channel's history oldest first, checkpointing the last message handled"""
+        guild_id = str(job.guild_id)
+        checkpoints = self.config["backfill"][guild_id]["channels"]
+        channel = self.get_channel(channel_id)
+        async with channel_limit:
+            if channel is not None:
+                after = discord.Object(id=checkpoints[str(channel_id)])
+                try:
+                    async for message in channel.history(limit=None, after=after, oldest_first=True):
+                        job.scanned += 1
+                        if (not message.author.bot and message.id not in copied
+                                and not self.processed_messages.is_copied(message.id)
+                                and await self.should_copy_message(message)
+                                and self.processed_messages.add(message.id)):
+                            # Pace to the copy workers instead of reading ahead
+                            while len(self.copy_lanes.get(media_channel_id, ())) >= self.backfill_backlog:
+                                await asyncio.sleep(0.5)
+                            self.journal.queued(message.id, channel_id)
+                            await self._dispatch([QueueItem(MessageRecord.from_message(message), datetime.now(), 0, True)])
+                            job.queued += 1
+                        
+                        checkpoints[str(channel_id)] = message.id
+                        if job.scanned % 100 == 0:
+                            # Checkpoints don't change routing - just persist them
+                            self.config_store.mark_dirty(guild_id)
+                except discord.HTTPException as e:
+                    # e.g. a private channel picked up by monitor_all - skip it rather than the whole backfill
+                    logger.warning(f"Backfill skipped #{channel.name} in guild {guild_id}: {e}")
+                    job.skipped += 1
+            del checkpoints[str(channel_id)]
+            self.config_store.mark_dirty(guild_id)
+    
+    async def _copied_source_ids(self, media_channel, after: int) -> Set[int]:
+        """
+        IDs of source messages the media channel already has copies of (from their jump links)
         
-        # For non-command messages, add to the processing queue
-        # Only add if not already copied
-        if message.id not in self.copied_messages:
-            async with self.queue_lock:
-                # Check if message is already in queue
-                existing = any(item['message'].id == message.id for item in self.message_queue)
-                if not existing:
-                    self.message_queue.append({
-                        'message': message,
-                        'time': current_time,
-                        'processed': False
-                    })
-                    logger.debug(f"Added message {message.id} to queue. Queue size: {len(self.message_queue)}")
-    
-    def _contains_twitter_link(self, message) -> bool:
-        """Check if message contains Twitter/X links"""
-        # Match twitter.com, x.com, and their variants
-        twitter_pattern = re.compile(r'https?://(?:www\.)?(twitter\.com|x\.com)', re.IGNORECASE)
-        return bool(message.content and twitter_pattern.search(message.content))
-    
-    def _cleanup_message_tracking(self, current_time):
-        """Clean up message tracking collections"""
-        # Keep messages processed in the last 5 minutes
-        cutoff_time = current_time - timedelta(minutes=5)
+        Reads the newest backfill_scan_limit copies since `after` the first
+        time, then only copies posted since the last read. Older copies are
+        still caught by the duplicate media check.
+        """
+        newest, copied = self.backfill_copied.get(media_channel.id, (after, None))
+        if copied is None:
+            copied = set()
+            history = media_channel.history(limit=self.backfill_scan_limit, after=discord.Object(id=after),
+                                            oldest_first=False)
+        else:
+            history = media_channel.history(limit=self.backfill_scan_limit, after=discord.Object(id=newest))
+        async for message in history:
+            newest = max(newest, message.id)
+            if message.author.id != self.user.id:
+                continue
+            for embed in message.embeds:
+                for field in embed.fields:
+                    if field.name == "Jump to Original":
+                        copied.update(int(message_id) for message_id in JUMP_URL_PATTERN.findall(field.value))
+        self.backfill_copied[media_channel.id] = (newest, copied)
+        return copied
+    
+    async def _report_backfill(self, job: BackfillJob):
+        """Keep the progress message of a backfill up to date"""
+        while True:
+            await asyncio.sleep(15)
+            try:
+                await job.progress_message.edit(embed=self.backfill_embed(job, "⏳ Backfill Running"))
+            except discord.HTTPException as e:
+                logger.debug(f"Could not update backfill progress: {e}")
+    
+    async def _copy_worker(self):
+        """
+        Copy queued messages from the destination lanes
         
-        # Clean up recently_processed dict
-        self.recently_processed = {msg_id: timestamp for msg_id, timestamp in self.recently_processed.items() 
-                               if timestamp > cutoff_time}
+        A worker takes the next ready lane, adds its turn's credit (deficit
+        round-robin) and copies messages (or bursts of uploads to merge) while
+        the credit covers them, then puts the lane back at the end of
+        ready_lanes if it still has work. Each lane is handled by one worker
+        at a time, keeping copies in order per destination. A merged burst
+        may overdraw the credit; the debt carries over to the next turn.
         
-        # Limit the size of copied_messages
-        if len(self.copied_messages) > 500:
-            # Convert to list, keep most recent 300 items
-            self.copied_messages = set(list(self.copied_messages)[-300:])
-    
-    async def _batch_processor(self):
-        """Periodically process messages in batches"""
-        await self.wait_until_ready()
+        A worker never waits on a lane: a burst of uploads that more may
+        still join, or a destination whose send rate limit has no token
+        left, parks the lane until it is due and the worker moves on -
+        before anything is downloaded for it.
+        """
         while not self.is_closed():
+            media_channel_id = await self.ready_lanes.get()
+            lane = self.copy_lanes[media_channel_id]
+            banked = deficit = self.lane_deficits.get(media_channel_id, 0.0)
+            parked = False
             try:
-                # Wait for the specified batch delay
-                await asyncio.sleep(self.batch_delay)
-                
-                # Set processing flag
-                self.processing_batch = True
-                
-                # Process messages in the queue
-                await self._process_queued_messages()
-                
-                # Reset processing flag
-                self.processing_batch = False
-                
-            except Exception as e:
-                logger.error(f"Error in batch processor: {e}")
+                # (The lane may have been emptied by load shedding while it waited)
+                if lane:
+                    deficit += self.lane_quantum * self.lane_weight(lane[0].message.guild)
+                    if self._copy_cost(lane[0]) > deficit:
+                        await asyncio.sleep(0)  # Not its turn yet - let the other lanes' workers run
+                while lane and self._copy_cost(lane[0]) <= deficit:
+                    wait = self._send_bucket(media_channel_id).delay(self._sends_needed(lane[0]))
+                    if wait > 0:
+                        self._park_lane(media_channel_id, time.monotonic() + wait)
+                        parked = True
+                        break
+                    if self.coalesce_window > 0 and self._can_coalesce(lane[0]):
+                        due = self._burst_due(lane)
+                        if due > time.monotonic():
+                            self._park_lane(media_channel_id, due)
+                            parked = True
+                            break
+                        items = self._pop_burst(lane)
+                    else:
+                        items = [lane.popleft()]
+                    now = time.monotonic()
+                    for item in items:
+                        deficit -= self._copy_cost(item)
+                        self.metrics.observe("mediabot_lane_wait_seconds", now - item.dispatched,
+                                             guild=item.message.guild.id)
+                    # (Shielded - close() lets a copy under way finish)
+                    copy = asyncio.ensure_future(self._copy_queued_messages(items))
+                    self.copies_underway.add(copy)
+                    copy.add_done_callback(self.copies_underway.discard)
+                    await asyncio.shield(copy)
+            finally:
+                if parked:
+                    # A parked turn that copied nothing earns no credit, or
+                    # each wake-up would add to the lane's share
+                    self.lane_deficits[media_channel_id] = min(deficit, banked)
+                elif lane:
+                    self.lane_deficits[media_channel_id] = deficit
+                    self.ready_lanes.put_nowait(media_channel_id)
+                else:
+                    # An idle lane doesn't bank credit
+                    self.lane_deficits.pop(media_channel_id, None)
+                    self.active_lanes.discard(media_channel_id)
+                    del self.copy_lanes[media_channel_id]
     
-    async def _process_queued_messages(self):
-        """Process all messages in the queue"""
-        # Skip if queue is empty
-        if not self.message_queue:
-            return
-            
-        # Get current time for cleanup
-        current_time = datetime.now()
-        cutoff_time = current_time - timedelta(minutes=5)
+    def lane_weight(self, guild) -> float:
+        """Share of the copy workers a guild gets when lanes compete for them"""
+        weight = self.guild_weights.get(guild.id)
+        if weight is None:
+            weight = max(1.0, math.log10(guild.member_count or 1)) if self.weight_by_size else 1.0
+        return max(weight, 0.1)
+    
+    @staticmethod
+    def _sends_needed(item) -> int:
+        """
+        Sends a copy will take, going by its files (a merged burst fits one)
         
-        # Create a copy of the queue to process
-        async with self.queue_lock:
-            processing_queue = []
-            for item in self.message_queue:
-                if item['processed']:
-                    continue
-                    
-                # Calculate wait time based on message content
-                message = item['message']
-                wait_seconds = 3  # Default wait time
-                
-                # Check if message contains Twitter/X links - they need more time for embeds
-                if self._contains_twitter_link(message):
-                    wait_seconds = 8  # Twitter embeds take longer to load
-                
-                # Check if enough time has passed
-                if (current_time - item['time']).total_seconds() >= wait_seconds:
-                    processing_queue.append(item)
-                    item['processing'] = True
+        Copies split further by the upload size limit wait for the extra
+        sends' tokens in copy_media_messages.
+        """
+        return max(1, -(-len(item.message.attachments) // MAX_FILES_PER_MESSAGE))
+    
+    @staticmethod
+    def _copy_cost(item) -> int:
+        """Scheduling cost of copying a message - uploads count per file"""
+        return 1 + len(item.message.attachments)
+    
+    def _can_coalesce(self, item) -> bool:
+        """Only plain uploads (no links to unfurl) are merged with their neighbours"""
+        message = item.message
+        return bool(message.attachments) and not URL_PATTERN.search(message.content)
+    
+    def _burst_length(self, lane: deque) -> Tuple[int, bool]:
+        """
+        Number of uploads at the head of a lane that merge into one copy
         
-        # Process each message
-        processed_count = 0
-        for item in processing_queue:
-            try:
-                # Get the message
-                message = item['message']
-                
+        Following uploads from the same author and channel join the first,
+        stopping at a message from someone else (to keep lane order) or once
+        the merged copy would need more than one send's worth of files. Also
+        returns whether the burst is closed - nothing later can join it.
+        """
+        first = lane[0].message
+        attachment_count = 0
+        for length, item in enumerate(lane):
+            message = item.message
+            if (message.author.id != first.author.id or message.channel.id != first.channel.id
+                    or not self._can_coalesce(item)
+                    or attachment_count + len(message.attachments) > MAX_FILES_PER_MESSAGE):
+                return max(length, 1), True
+            attachment_count += len(message.attachments)
+        return len(lane), attachment_count >= MAX_FILES_PER_MESSAGE
+    
+    def _burst_due(self, lane: deque) -> float:
+        """When the burst at the head of a lane is copied (monotonic time)"""
+        length, closed = self._burst_length(lane)
+        if closed:
+            return 0.0
+        return lane[length - 1].dispatched + self.coalesce_window
+    
+    def _pop_burst(self, lane: deque) -> list:
+        """Take the burst at the head of a lane"""
+        length, _ = self._burst_length(lane)
+        return [lane.popleft() for _ in range(length)]
+    
+    def _park_lane(self, media_channel_id: int, due: float):
+        """Leave a lane out of ready_lanes until due, or a new message for it"""
+        def wake():
+            del self.parked_lanes[media_channel_id]
+            self.ready_lanes.put_nowait(media_channel_id)
+        
+        self.parked_lanes[media_channel_id] = asyncio.get_running_loop().call_later(
+            due - time.monotonic(), wake)
+    
+    async def _copy_queued_messages(self, items: list):
+        """Check queued messages and copy them together"""
+        cancelled = False
+        try:
+            copying = []
+            for item in items:
+                message = item.message
                 # Skip if already copied
-                if message.id in self.copied_messages:
-                    item['processed'] = True
+                if self.processed_messages.is_copied(message.id):
                     continue
-                
-                # Try to get a fresh copy of the message with potentially loaded embeds
-                try:
-                    channel = self.get_channel(message.channel.id)
-                    if channel:
-                        message = await channel.fetch_message(message.id)
-                except Exception as e:
-                    # If we can't fetch the message, use the original one
-                    logger.debug(f"Could not fetch fresh message: {e}")
-                
-                # Check if it should be copied and copy it
+                # Check if it should be copied
                 if await self.should_copy_message(message):
-                    await self.copy_media_message(message)
-                    processed_count += 1
-                
-                # Mark as processed
-                item['processed'] = True
-                
-            except Exception as e:
-                logger.error(f"Error processing message in batch: {e}")
-        
-        # Clean up the queue - remove processed and old messages
-        async with self.queue_lock:
-            self.message_queue = [
-                item for item in self.message_queue 
-                if not item['processed'] and item['time'] > cutoff_time
-            ]
+                    copying.append(item)
             
-        # Clean up tracking
-        self._cleanup_message_tracking(current_time)
+            if copying and await self.copy_media_messages([item.message for item in copying]):
+                now = datetime.now()
+                for item in copying:
+                    guild_id = item.message.guild.id
+                    self.metrics.inc("mediabot_messages_copied_total", guild=guild_id)
+                    self.metrics.observe("mediabot_copy_latency_seconds",
+                                         (now - item.time).total_seconds(), guild=guild_id)
             
-        if processed_count > 0:
-            logger.info(f"Batch processed {processed_count} messages. Queue size now: {len(self.message_queue)}")
+        except asyncio.CancelledError:
+            cancelled = True
+            raise
+        except Exception as e:
+            logger.error(f"Error processing queued message: {e}")
+        finally:
+            # Mark as processed
+            async with self.queue_lock:
+                for item in items:
+                    self.message_queue.complete(item.message.id)
+            retry = []
+            for item in items:
+                message = item.message
+                copied = self.processed_messages.is_copied(message.id)
+                if cancelled and not copied:
+                    # Shutting down - left pending in the journal for the next run
+                    continue
+                self.journal.finished(message.id, message.channel.id, copied)
+                late = self.late_unfurls.pop(message.id, None)
+                if late is not None and not copied:
+                    self.journal.queued(message.id, message.channel.id)
+                    retry.append(QueueItem(late, datetime.now(), 0, True))
+            if retry:
+                await self._dispatch(retry)
+    
+    def _send_bucket(self, channel_id: int) -> TokenBucket:
+        """Return the send token bucket for a destination channel"""
+        bucket = self.send_buckets.get(channel_id)
+        if bucket is None:
+            bucket = self.send_buckets[channel_id] = TokenBucket()
+        return bucket
+    
+    async def _on_discord_response(self, session, trace_config_ctx, params):
+        """
+        Count Discord REST requests, and feed destination token buckets from
+        the rate-limit headers of message sends
+        """
+        path = params.url.path
+        match = CHANNEL_MESSAGES_PATH.search(path)
+        if match and params.method == "POST":
+            route = "send"
+        elif match:
+            route = "history"
+        elif params.method == "GET" and CHANNEL_MESSAGE_PATH.search(path):
+            route = "fetch_message"
+        else:
+            route = "other"
+        self.metrics.inc("mediabot_discord_requests_total", route=route, status=params.response.status)
+        
+        if route != "send":
+            return
+        bucket = self.send_buckets.get(int(match.group(1)))
+        if bucket is None:
+            return
+        
+        headers = params.response.headers
+        try:
+            if params.response.status == 429:
+                bucket.pause(float(headers.get("Retry-After", 1)))
+            elif "X-RateLimit-Remaining" in headers:
+                bucket.update(
+                    int(headers.get("X-RateLimit-Limit", bucket.capacity)),
+                    int(headers["X-RateLimit-Remaining"]),
+                    float(headers.get("X-RateLimit-Reset-After", 0))
+                )
+        except ValueError:
+            logger.debug(f"Unparseable rate-limit headers for {params.url.path}")
     
     async def should_copy_message(self, message) -> bool:
         """Check if message contains media and is from a monitored channel"""
         if not message.guild:
             return False
-            
-        guild_id = str(message.guild.id)
         
-        # Check if guild is configured
-        if guild_id not in self.config["monitored_channels"]:
-            return False
-            
-        # Check if media channel is set
-        media_channel_id = self.config["media_channels"].get(guild_id)
-        if not media_channel_id:
-            return False
-            
-        # Don't copy from the media channel itself
-        if message.channel.id == media_channel_id:
+        # Check if guild has a media channel and routes this channel
+        route = self.routes.get(message.guild.id)
+        if route is None or not route.accepts(message.channel.id):
             return False
             
-        # Check monitoring mode
-        if self.config["monitor_all"].get(guild_id, False):
-            # Monitor all channels except media channel and excluded channels
-            excluded_channels = self.config["excluded_channels"].get(guild_id, [])
-            if message.channel.id in excluded_channels:
-                return False
-        else:
-            # Check if channel is in monitored list
-            if message.channel.id not in self.config["monitored_channels"][guild_id]:
-                return False
-            
         # Check if message has media content
         return self.has_media_content(message)
     
@@ -339,106 +2764,110 @@ class MediaCopyBot(commands.Bot):
         - Twitter/X links with media content
         """
         # Check for direct uploads (attachments)
-        if message.attachments:
-            for attachment in message.attachments:
-                # Check if attachment is image/video/gif
-                if any(attachment.filename.lower().endswith(ext) for ext in 
-                       ['.png', '.jpg', '.jpeg', '.gif', '.webp', '.mp4', 
-                        '.mov', '.avi', '.webm', '.bmp', '.tiff']):
-                    return True
+        if self._has_media_attachment(message):
+            return True
         
         # Check for embedded media (from URLs)
-        if message.embeds:
-            for embed in message.embeds:
-                # Check for image/video content or rich embeds with media
-                if embed.image or embed.video:
-                    return True
-                if embed.thumbnail:
-                    # Only count thumbnails from certain embed types
-                    if embed.type in ['image', 'video', 'gifv', 'article', 'link', 'rich']:
-                        return True
-                # Check by embed type
-                if embed.type in ['image', 'video', 'gifv']:
-                    return True
-                # Special handling for Twitter/X embeds
-                if embed.type in ['link', 'rich', 'article']:
-                    # Check if it's a Twitter/X link with media
-                    if (embed.url and ('twitter.com' in embed.url or 'x.com' in embed.url)) and \
-                       (embed.thumbnail or embed.image or embed.video):
-                        return True
-        
+        return any(self._is_media_embed(embed) for embed in message.embeds)
+    
+    def _embedded_sites(self, message) -> Set[str]:
+        """Sites whose links in the message already have a media embed"""
+        sites = set()
+        for embed in message.embeds:
+            if embed.url and self._is_media_embed(embed):
+                sites.update(link_sites(embed.url))
+        return sites
+    
+    def _is_media_embed(self, embed) -> bool:
+        """Check if an embed carries image/video content"""
+        # Check for image/video content or rich embeds with media
+        if embed.image or embed.video:
+            return True
+        if embed.thumbnail:
+            # Only count thumbnails from certain embed types
+            if embed.type in ['image', 'video', 'gifv', 'article', 'link', 'rich']:
+                return True
+        # Check by embed type
+        if embed.type in ['image', 'video', 'gifv']:
+            return True
+        # Special handling for Twitter/X embeds
+        if embed.type in ['link', 'rich', 'article']:
+            # Check if it's a Twitter/X link with media
+            if (embed.url and ('twitter.com' in embed.url or 'x.com' in embed.url)) and \
+               (embed.thumbnail or embed.image or embed.video):
+                return True
         return False
     
-    async def copy_media_message(self, message):
+    def _has_media_attachment(self, message) -> bool:
+        """Check if any attachment is an image/video/gif"""
+        return any(attachment.filename.lower().endswith(MEDIA_EXTENSIONS) for attachment in message.attachments)
+    
+    async def copy_media_message(self, message) -> bool:
         """Copy message with media to the designated media channel"""
+        return await self.copy_media_messages([MessageRecord.from_message(message)])
+    
+    async def copy_media_messages(self, messages: List[MessageRecord]) -> bool:
+        """
+        Copy one or more messages (a burst from the same author and channel)
+        to the designated media channel, returning whether anything was sent
+        
+        The media is packed into as few sends as Discord's limits allow:
+        10 files and 10 embeds per message, within the upload size limit.
+        """
+        first = messages[0]
         try:
             # Mark as copied immediately to prevent duplicates
-            self.copied_messages.add(message.id)
+            for message in messages:
+                self.processed_messages.mark_copied(message.id)
             
-            guild_id = str(message.guild.id)
-            media_channel_id = self.config["media_channels"][guild_id]
+            route = self.routes.get(first.guild.id)
+            if route is None:
+                return False
+            media_channel_id = route.media_channel_id
             media_channel = self.get_channel(media_channel_id)
             
             if not media_channel:
                 logger.warning(f"Media channel {media_channel_id} not found")
-                return
+                return False
             
-            # Check bot permissions in media channel
-            permissions = media_channel.permissions_for(message.guild.me)
+            # Check bot permissions in media channel (guild.me is cached even
+            # in the lean profile, but fetch it should a guild come without it)
+            me = first.guild.me or await first.guild.fetch_member(self.user.id)
+            permissions = media_channel.permissions_for(me)
             if not permissions.send_messages or not permissions.attach_files:
                 logger.warning(f"Missing permissions in {media_channel.name}")
-                return
-            
-            # Rate limit check - avoid spamming
-            await asyncio.sleep(0.5)
+                return False
             
             # Create new embed for the copied message
-            include_author = self.config["include_author"][guild_id]
-            
-            # Handle direct file uploads
-            files = []
-            if message.attachments:
-                for attachment in message.attachments:
-                    # Check file size (Discord bot limit is 8MB)
-                    if attachment.size <= 8 * 1024 * 1024:
-                        try:
-                            # Download attachment
-                            async with aiohttp.ClientSession() as session:
-                                async with session.get(attachment.url) as resp:
-                                    if resp.status == 200:
-                                        file_data = await resp.read()
-                                        files.append(
-                                            discord.File(
-                                                io.BytesIO(file_data),
-                                                filename=attachment.filename,
-                                                spoiler=attachment.is_spoiler()
-                                            )
-                                        )
-                        except Exception as e:
-                            logger.error(f"Error downloading attachment: {e}")
+            include_author = route.include_author
             
             # Create info embed
+            content = "\n".join(message.content for message in messages if message.content)
             embed = discord.Embed(
-                description=message.content[:1024] if message.content else None,
+                description=content[:1024] if content else None,
                 color=0x00ff00,
-                timestamp=message.created_at
+                timestamp=messages[-1].created_at
             )
             
             if include_author:
                 embed.set_author(
-                    name=f"{message.author.display_name}",
-                    icon_url=message.author.display_avatar.url
+                    name=f"{first.author.display_name}",
+                    icon_url=first.author.avatar_url
                 )
             
             embed.add_field(
                 name="Source",
-                value=f"#{message.channel.name}",
+                value=f"#{first.channel.name}",
                 inline=True
             )
             
+            if len(messages) == 1:
+                jump_links = f"[Click here]({first.jump_url})"
+            else:
+                jump_links = " ".join(f"[{number}]({message.jump_url})" for number, message in enumerate(messages, 1))
             embed.add_field(
                 name="Jump to Original",
-                value=f"[Click here]({message.jump_url})",
+                value=jump_links[:1024],
                 inline=True
             )
             
@@ -446,8 +2875,8 @@ class MediaCopyBot(commands.Bot):
             embeds_to_send = []
             
             # Copy original embeds first (for URL embeds with media)
-            if message.embeds:
-                for original_embed in message.embeds[:9]:  # Max 10 embeds total
+            for message in messages:
+                for original_embed in message.embeds:
                     try:
                         # Only copy embeds that have media
                         if (original_embed.image or original_embed.video or 
@@ -460,18 +2889,404 @@ class MediaCopyBot(commands.Bot):
             # Add info embed last so it appears after media
             embeds_to_send.append(embed)
             
-            # Send the copied message
-            await media_channel.send(
-                files=files,
-                embeds=embeds_to_send
-            )
+            duplicate_mode = route.duplicate_mode
+            attachments = [attachment for message in messages for attachment in message.attachments]
+            
+            # Handle direct file uploads - buffers are released once the sends are done
+            size_limit = media_channel.guild.filesize_limit
+            oversized = self._shedding("skip-oversize") and [
+                (attachment, message) for message in messages
+                for attachment in message.attachments if attachment.size > size_limit
+            ]
+            if oversized:
+                # Degraded: no re-encoding now - files over the limit follow once it ends
+                attachments = [a for a in attachments if a.size <= size_limit]
+                self._defer_oversized(oversized, media_channel, size_limit)
+            async with self._downloaded_attachments(attachments, size_limit, duplicate_mode != "off") as downloads:
+                # Drop media this guild has already had copied recently
+                new_downloads, duplicate_links, similar_links = await self._split_duplicates(
+                    first.guild.id, downloads, duplicate_mode
+                )
+                # Only then shrink oversized images - no re-encoding media that isn't sent
+                new_downloads = await self._fit_to_limit(new_downloads, size_limit)
+                if similar_links:
+                    embed.add_field(
+                        name="Looks Like",
+                        value="\n".join(f"[Earlier copy]({link})" for link in similar_links)[:1024],
+                        inline=False
+                    )
+                if duplicate_links:
+                    if not new_downloads and len(embeds_to_send) == 1 and duplicate_mode == "skip":
+                        logger.info(f"Skipped duplicate media from #{first.channel.name}")
+                        return False
+                    if duplicate_mode == "link":
+                        embed.add_field(
+                            name="Already Posted",
+                            value="\n".join(f"[Earlier copy]({link})" for link in duplicate_links)[:1024],
+                            inline=False
+                        )
+                
+                # Split into sends that fit Discord's limits
+                sends = pack_sends(new_downloads, embeds_to_send, size_limit)
+                for send_downloads, send_embeds in sends:
+                    # Wait for the destination's rate limit
+                    await self._send_bucket(media_channel.id).acquire()
+                    
+                    # Send the copied message
+                    sent = await media_channel.send(
+                        files=[download.file for download in send_downloads],
+                        embeds=send_embeds
+                    )
+                    self.metrics.inc("mediabot_upload_bytes_total",
+                                     sum(download.size for download in send_downloads), guild=first.guild.id)
+                    
+                    if duplicate_mode != "off":
+                        for download in send_downloads:
+                            await self.media_index.record(first.guild.id, download.digest, download.phash, sent.jump_url)
+            
+            # Oversized videos and GIFs follow once transcoded
+            if self.ffmpeg and not oversized:
+                for message in messages:
+                    for attachment in message.attachments:
+                        if attachment.size > size_limit and self._can_transcode(attachment):
+                            self._queue_transcode(attachment, message, media_channel, size_limit)
             
-            logger.info(f"Copied media from #{message.channel.name} to #{media_channel.name}")
+            copied = f"{len(messages)} messages" if len(messages) > 1 else "media"
+            logger.info(f"Copied {copied} from #{first.channel.name} to #{media_channel.name} in {len(sends)} sends")
+            return True
             
         except discord.HTTPException as e:
             logger.error(f"Discord API error: {e}")
         except Exception as e:
             logger.error(f"Error copying message: {e}")
+        return False
+
+    async def _split_duplicates(self, guild_id: int, downloads: List[DownloadedAttachment], duplicate_mode: str):
+        """
+        Split downloads into new media and links to earlier copies of duplicates
+        
+        Returns (new downloads, duplicate links, similar links). Images that
+        only look like an earlier copy (perceptual hash) are only left out
+        in link mode, where the link shows instead; in skip mode they are
+        copied with a link to the lookalike, so a false match never hides media.
+        """
+        if duplicate_mode == "off":
+            return downloads, [], []
+        
+        new_downloads = []
+        duplicate_links = []
+        similar_links = []
+        seen = set()
+        for download in downloads:
+            if download.digest in seen:
+                continue  # Same file attached twice to one message
+            seen.add(download.digest)
+            
+            match = await self.media_index.lookup(guild_id, download.digest, download.phash, self.duplicate_window)
+            if match is None:
+                new_downloads.append(download)
+                continue
+            link, exact = match
+            if exact or duplicate_mode == "link":
+                duplicate_links.append(link)
+                self.metrics.inc("mediabot_duplicates_total", guild=guild_id)
+            else:
+                new_downloads.append(download)
+                similar_links.append(link)
+        return new_downloads, duplicate_links, similar_links
+    
+    @contextlib.asynccontextmanager
+    async def _downloaded_attachments(self, attachments: list, size_limit: int, perceptual_hash: bool = False):
+        """
+        Download a copy's attachments concurrently, keeping their order
+        
+        Their total size is reserved from the download budget up front
+        (all or nothing, so copies never deadlock holding part of it). Yields
+        DownloadedAttachments backed by spooled buffers, which are closed and
+        returned to the budget on exit. With perceptual_hash, images also get
+        a dHash computed off the event loop. Images over size_limit are
+        downloaded for _fit_to_limit to re-encode; other files over it are
+        left out.
+        """
+        # Check file size against the destination's upload limit
+        attachments = [a for a in attachments if a.size <= size_limit or self._can_recompress(a)]
+        if not attachments:
+            yield []
+            return
+        
+        reserved = await self.download_budget.acquire(sum(a.size for a in attachments))
+        downloads = []
+        try:
+            message_limit = asyncio.Semaphore(self.download_concurrency_per_message)
+            results = await asyncio.gather(
+                *(self._download_attachment(attachment, message_limit) for attachment in attachments)
+            )
+            downloads = [result for result in results if result is not None]
+            
+            if perceptual_hash and Image is not None:
+                loop = asyncio.get_running_loop()
+                for download in downloads:
+                    if download.file.filename.lower().endswith(HASHABLE_IMAGE_EXTENSIONS):
+                        phash = await loop.run_in_executor(None, image_dhash, download.buffer)
+                        download.buffer.seek(0)
+                        if phash is not None:
+                            download.phash = f"{phash:016x}"
+            
+            yield downloads
+        finally:
+            for download in downloads:
+                download.close()
+            self.download_budget.release(reserved)
+    
+    async def _fit_to_limit(self, downloads: List[DownloadedAttachment], size_limit: int) -> List[DownloadedAttachment]:
+        """Re-encode downloads over size_limit, leaving out any that can't be shrunk (hashes stay the original's)"""
+        fitting = []
+        for download in downloads:
+            if download.size <= size_limit or await self._recompress(download, size_limit):
+                fitting.append(download)
+            else:
+                download.close()
+        return fitting
+    
+    def _can_recompress(self, attachment) -> bool:
+        """Whether an attachment over the upload limit is an image worth shrinking"""
+        return (
+            Image is not None
+            and attachment.filename.lower().endswith(RECOMPRESSIBLE_EXTENSIONS)
+            and attachment.size <= self.recompress_max_source
+        )
+    
+    async def _recompress(self, download: DownloadedAttachment, size_limit: int) -> bool:
+        """Replace an oversized image download with a re-encoded copy that fits size_limit"""
+        key = (download.digest, size_limit)
+        result = self.recompress_cache.get(key)
+        if result is None:
+            # (Up to recompress_max_source bytes, maybe from a temp file - read off the event loop)
+            download.buffer.seek(0)
+            loop = asyncio.get_running_loop()
+            data = await loop.run_in_executor(None, download.buffer.read)
+            if self.image_pool is None:
+                # Forked workers on POSIX - spawned or forkserver ones (the macOS
+                # and Python 3.14+ defaults) re-import this script and so build
+                # a whole bot each, opening the journal and config store
+                context = multiprocessing.get_context("fork") if os.name == "posix" else None
+                self.image_pool = ProcessPoolExecutor(max_workers=self.image_workers, mp_context=context)
+            try:
+                result = await loop.run_in_executor(
+                    self.image_pool, shrink_image, data, download.file.filename, size_limit
+                )
+            except Exception as e:
+                logger.error(f"Error recompressing {download.file.filename}: {e}")
+                return False
+            if result is None:
+                logger.info(f"Could not shrink {download.file.filename} below {size_limit} bytes")
+                return False
+            self.recompress_cache.put(key, result)
+        
+        data, filename = result
+        logger.info(f"Recompressed {download.file.filename} from {download.size} to {len(data)} bytes")
+        download.close()
+        download.buffer = io.BytesIO(data)
+        download.size = len(data)
+        download.file = discord.File(download.buffer, filename=filename, spoiler=download.file.spoiler)
+        return True
+    
+    async def _recompress_and_send(self, attachment, message, media_channel, size_limit: int):
+        """Download an oversized image left out of its copy, re-encode it to fit size_limit and post it"""
+        guild_id = message.guild.id
+        route = self.routes.get(guild_id)
+        duplicate_mode = route.duplicate_mode if route else "off"
+        async with self._downloaded_attachments([attachment], size_limit, duplicate_mode != "off") as downloads:
+            new_downloads, _, _ = await self._split_duplicates(guild_id, downloads, duplicate_mode)
+            new_downloads = await self._fit_to_limit(new_downloads, size_limit)
+            if not new_downloads:
+                return
+            download = new_downloads[0]
+            embed = discord.Embed(
+                description=f"[{attachment.filename}]({message.jump_url}) from #{message.channel.name}, "
+                            f"re-encoded to fit the upload limit",
+                color=0x00ff00
+            )
+            await self._send_bucket(media_channel.id).acquire()
+            sent = await media_channel.send(file=download.file, embed=embed)
+            if duplicate_mode != "off":
+                await self.media_index.record(guild_id, download.digest, download.phash, sent.jump_url)
+    
+    def _can_transcode(self, attachment) -> bool:
+        """Whether an attachment over the upload limit is a video or GIF worth transcoding"""
+        return (
+            attachment.filename.lower().endswith(TRANSCODABLE_EXTENSIONS)
+            and attachment.size <= self.transcode_max_source
+        )
+    
+    def _queue_transcode(self, attachment, message, media_channel, size_limit: int):
+        """Hand an oversized video or GIF to the transcode pool"""
+        if self.transcode_pool.submit(attachment.filename, self._transcode_and_send,
+                                      attachment, message, media_channel, size_limit):
+            self.metrics.inc("mediabot_transcodes_total", result="queued")
+        else:
+            self.metrics.inc("mediabot_transcodes_total", result="rejected")
+            logger.warning(f"Transcode queue full, skipping {attachment.filename}")
+    
+    async def _transcode_and_send(self, attachment, message, media_channel, size_limit: int):
+        """
+        Download an oversized video or GIF to disk, transcode it to fit size_limit and post it
+        
+        Unless the guild has duplicate_media off, a file already posted
+        within duplicate_window (by its SHA-256) is not transcoded again.
+        """
+        guild_id = message.guild.id
+        route = self.routes.get(guild_id)
+        duplicate_mode = route.duplicate_mode if route else "off"
+        with tempfile.TemporaryDirectory(prefix="mediabot-transcode-") as workdir:
+            source = os.path.join(workdir, "source" + os.path.splitext(attachment.filename)[1].lower())
+            digest = await self._download_to_file(attachment.url, source)
+            if digest is None:
+                self.metrics.inc("mediabot_transcodes_total", result="failed")
+                return
+            
+            if duplicate_mode != "off" and await self.media_index.lookup(
+                    guild_id, digest, None, self.duplicate_window) is not None:
+                self.metrics.inc("mediabot_transcodes_total", result="duplicate")
+                self.metrics.inc("mediabot_duplicates_total", guild=guild_id)
+                logger.info(f"Skipped duplicate {attachment.filename} from #{message.channel.name}")
+                return
+            
+            output = os.path.join(workdir, "output.mp4")
+            if not await self._transcode(source, output, size_limit, attachment.filename.lower().endswith('.gif')):
+                self.metrics.inc("mediabot_transcodes_total", result="failed")
+                logger.info(f"Could not transcode {attachment.filename} below {size_limit} bytes")
+                return
+            
+            filename = os.path.splitext(attachment.filename)[0] + ".mp4"
+            embed = discord.Embed(
+                description=f"[{attachment.filename}]({message.jump_url}) from #{message.channel.name}, "
+                            f"re-encoded to fit the upload limit",
+                color=0x00ff00
+            )
+            await self._send_bucket(media_channel.id).acquire()
+            sent = await media_channel.send(file=discord.File(output, filename=filename), embed=embed)
+            self.metrics.inc("mediabot_transcodes_total", result="sent")
+            if duplicate_mode != "off":
+                await self.media_index.record(guild_id, digest, None, sent.jump_url)
+            logger.info(f"Transcoded {attachment.filename} ({attachment.size} -> {os.path.getsize(output)} bytes)")
+    
+    async def _download_to_file(self, url: str, path: str) -> Optional[str]:
+        """Stream a download straight to a file, returning its SHA-256 (None if it failed)"""
+        try:
+            timeout = aiohttp.ClientTimeout(total=None, sock_read=60)
+            async with self._get_download_session().get(url, timeout=timeout) as resp:
+                if resp.status != 200:
+                    logger.error(f"Error downloading {url} for transcoding: HTTP {resp.status}")
+                    return None
+                digest = hashlib.sha256()
+                with open(path, 'wb') as f:
+                    async for chunk in resp.content.iter_chunked(DOWNLOAD_CHUNK_SIZE):
+                        digest.update(chunk)
+                        f.write(chunk)
+            return digest.hexdigest()
+        except (aiohttp.ClientError, asyncio.TimeoutError) as e:
+            logger.error(f"Error downloading {url} for transcoding: {str(e) or type(e).__name__}")
+            return None
+    
+    async def _transcode(self, source: str, output: str, size_limit: int, is_gif: bool) -> bool:
+        """
+        Encode source to an H.264 MP4 of at most size_limit bytes
+        
+        The bitrate is worked out from the clip's duration (from ffprobe);
+        if the first pass still comes out too big, a second one halves the
+        resolution and aims lower.
+        """
+        if not self.ffprobe:
+            return False
+        returncode, stdout, _ = await run_process(
+            self.ffprobe, "-v", "error", "-show_entries", "format=duration",
+            "-of", "default=noprint_wrappers=1:nokey=1", source
+        )
+        try:
+            duration = float(stdout) if returncode == 0 else 0.0
+        except ValueError:
+            duration = 0.0
+        if duration <= 0:
+            return False
+        
+        audio_kbps = 0 if is_gif else 96
+        total_kbps = size_limit * 8 / 1000 / duration * 0.9  # leave room for the container
+        for scale, share in ((1.0, 1.0), (0.5, 0.8)):
+            video_kbps = int(total_kbps * share) - audio_kbps
+            if video_kbps < 100:
+                return False  # Too long to fit at a watchable quality
+            audio = ["-an"] if is_gif else ["-c:a", "aac", "-b:a", f"{audio_kbps}k"]
+            returncode, _, stderr = await run_process(
+                self.ffmpeg, "-v", "error", "-y", "-i", source,
+                "-vf", f"scale=trunc(iw*{scale}/2)*2:trunc(ih*{scale}/2)*2",
+                "-c:v", "libx264", "-preset", "veryfast", "-pix_fmt", "yuv420p",
+                "-b:v", f"{video_kbps}k", "-maxrate", f"{video_kbps}k", "-bufsize", f"{2 * video_kbps}k",
+                "-threads", str(self.transcode_threads), "-movflags", "+faststart",
+                *audio, output
+            )
+            if returncode != 0:
+                logger.error(f"ffmpeg failed: {stderr.decode(errors='replace').strip()[-500:]}")
+                return False
+            if os.path.getsize(output) <= size_limit:
+                return True
+        return False
+    
+    async def _download_attachment(self, attachment, message_limit: asyncio.Semaphore) -> Optional[DownloadedAttachment]:
+        """
+        Download one attachment, retrying with backoff on 5xx/429 and network errors
+        
+        The attachment is streamed in chunks into memory if small, or into a
+        temp file on disk otherwise, and hashed (SHA-256) as it arrives.
+        """
+        session = self._get_download_session()
+        error = None
+        reason = None
+        for attempt in range(self.download_retries + 1):
+            if attempt:
+                self.metrics.inc("mediabot_download_retries_total", reason=reason)
+                await asyncio.sleep(self.download_backoff * 2 ** (attempt - 1))
+            
+            buffer = None
+            try:
+                # Hold both limits only while actually downloading, not while backing off
+                async with message_limit, self.download_semaphore:
+                    async with session.get(attachment.url) as resp:
+                        if resp.status == 200:
+                            if attachment.size > self.spool_threshold:
+                                buffer = tempfile.TemporaryFile()
+                            else:
+                                buffer = io.BytesIO()
+                            digest = hashlib.sha256()
+                            size = 0
+                            async for chunk in resp.content.iter_chunked(DOWNLOAD_CHUNK_SIZE):
+                                buffer.write(chunk)
+                                digest.update(chunk)
+                                size += len(chunk)
+                            buffer.seek(0)
+                            file = discord.File(
+                                buffer,
+                                filename=attachment.filename,
+                                spoiler=attachment.is_spoiler()
+                            )
+                            # The caller owns the buffer from here on
+                            download = DownloadedAttachment(file, buffer, size, digest.hexdigest())
+                            buffer = None
+                            self.metrics.inc("mediabot_download_bytes_total", size)
+                            return download
+                        error = f"HTTP {resp.status}"
+                        reason = "429" if resp.status == 429 else "5xx"
+                        if resp.status < 500 and resp.status != 429:
+                            break  # Not worth retrying
+            except (aiohttp.ClientError, asyncio.TimeoutError) as e:
+                error = str(e) or type(e).__name__
+                reason = "network"
+            finally:
+                if buffer is not None:
+                    buffer.close()
+        
+        logger.error(f"Error downloading attachment {attachment.filename}: {error}")
+        return None
 
 # Initialize bot
 bot = MediaCopyBot()
@@ -486,7 +3301,7 @@ async def setup_media_channel(ctx, channel: discord.TextChannel):
     """Set up the media channel for this server"""
     guild_id = str(ctx.guild.id)
     bot.config["media_channels"][guild_id] = channel.id
-    bot.save_config()
+    bot.save_config(guild_id)
     
     embed = discord.Embed(
         title="✅ Media Channel Set",
@@ -513,7 +3328,7 @@ async def monitor_add(ctx, channel: discord.TextChannel):
     
     if channel.id not in bot.config["monitored_channels"][guild_id]:
         bot.config["monitored_channels"][guild_id].append(channel.id)
-        bot.save_config()
+        bot.save_config(guild_id)
         
         embed = discord.Embed(
             title="✅ Channel Added",
@@ -538,7 +3353,7 @@ async def monitor_remove(ctx, channel: discord.TextChannel):
         channel.id in bot.config["monitored_channels"][guild_id]):
         
         bot.config["monitored_channels"][guild_id].remove(channel.id)
-        bot.save_config()
+        bot.save_config(guild_id)
         
         embed = discord.Embed(
             title="✅ Channel Removed",
@@ -564,7 +3379,7 @@ async def monitor_exclude(ctx, channel: discord.TextChannel):
     
     if channel.id not in bot.config["excluded_channels"][guild_id]:
         bot.config["excluded_channels"][guild_id].append(channel.id)
-        bot.save_config()
+        bot.save_config(guild_id)
         
         embed = discord.Embed(
             title="✅ Channel Excluded",
@@ -589,7 +3404,7 @@ async def monitor_include(ctx, channel: discord.TextChannel):
         channel.id in bot.config["excluded_channels"][guild_id]):
         
         bot.config["excluded_channels"][guild_id].remove(channel.id)
-        bot.save_config()
+        bot.save_config(guild_id)
         
         embed = discord.Embed(
             title="✅ Channel Included",
@@ -615,11 +3430,11 @@ async def monitor_all(ctx, enabled: bool = None):
         enabled = not current
     
     bot.config["monitor_all"][guild_id] = enabled
-    bot.save_config()
-    
     if enabled:
         bot.config["monitored_channels"][guild_id] = []
-        bot.save_config()
+    bot.save_config(guild_id)
+    
+    if enabled:
         excluded_count = len(bot.config["excluded_channels"].get(guild_id, []))
         if excluded_count > 0:
             status = f"🌐 Now monitoring **all channels** (except destination + {excluded_count} excluded)"
@@ -700,6 +3515,80 @@ async def monitor_list(ctx):
     
     await ctx.send(embed=embed)
 
+# Command group: Backfill
+@bot.hybrid_group(name="backfill", description="Copy media already posted in monitored channels")
+@commands.has_permissions(manage_channels=True)
+async def backfill_group(ctx):
+    """Parent group for backfill commands"""
+    if ctx.invoked_subcommand is None:
+        await ctx.send("Use `/backfill start`, `/backfill status` or `/backfill stop`")
+
+@backfill_group.command(name="start", description="Copy media from the history of monitored channels")
+async def backfill_start(ctx, channel: Optional[discord.TextChannel] = None, days: int = 30):
+    """Start (or resume) copying media posted in the last `days` days"""
+    if ctx.guild.id in bot.backfills:
+        await ctx.send(embed=bot.backfill_embed(bot.backfills[ctx.guild.id], "⏳ Backfill Already Running"))
+        return
+    
+    route = bot.routes.get(ctx.guild.id)
+    if route is None:
+        embed = discord.Embed(
+            title="❌ No Media Channel",
+            description="Set a media channel with `/setup` first",
+            color=0xff0000
+        )
+        await ctx.send(embed=embed)
+        return
+    if channel is not None and not route.accepts(channel.id):
+        embed = discord.Embed(
+            title="❌ Not Monitored",
+            description=f"{channel.mention} is not being monitored",
+            color=0xff0000
+        )
+        await ctx.send(embed=embed)
+        return
+    
+    resuming = str(ctx.guild.id) in bot.config["backfill"]
+    embed = discord.Embed(
+        title="⏳ Backfill Starting",
+        description=(
+            "Resuming the interrupted backfill" if resuming
+            else f"Copying media from the last {days} days of "
+                 + (channel.mention if channel else "all monitored channels")
+        ),
+        color=0x0099ff
+    )
+    progress_message = await ctx.send(embed=embed)
+    bot.start_backfill(ctx.guild, [channel.id] if channel else None, days, progress_message)
+
+@backfill_group.command(name="status", description="Show backfill progress")
+async def backfill_status(ctx):
+    """Show the progress of this server's backfill"""
+    job = bot.backfills.get(ctx.guild.id)
+    if job is not None:
+        embed = bot.backfill_embed(job, "⏳ Backfill Running")
+    elif str(ctx.guild.id) in bot.config["backfill"]:
+        embed = discord.Embed(
+            title="⏸️ Backfill Paused",
+            description="Use `/backfill start` to resume",
+            color=0x0099ff
+        )
+    else:
+        embed = discord.Embed(title="No Backfill Running", color=0x0099ff)
+    await ctx.send(embed=embed)
+
+@backfill_group.command(name="stop", description="Pause the running backfill")
+async def backfill_stop(ctx):
+    """Pause this server's backfill - /backfill start resumes it"""
+    job = bot.backfills.get(ctx.guild.id)
+    if job is None:
+        await ctx.send(embed=discord.Embed(title="No Backfill Running", color=0x0099ff))
+        return
+    job.task.cancel()
+    embed = bot.backfill_embed(job, "⏸️ Backfill Paused")
+    embed.description = "Use `/backfill start` to resume"
+    await ctx.send(embed=embed)
+
 @bot.hybrid_command(name="toggle_author", description="Toggle author attribution")
 @commands.has_permissions(manage_channels=True)
 async def toggle_author_attribution(ctx):
@@ -708,7 +3597,7 @@ async def toggle_author_attribution(ctx):
     
     current = bot.config["include_author"].get(guild_id, True)
     bot.config["include_author"][guild_id] = not current
-    bot.save_config()
+    bot.save_config(guild_id)
     
     status = "enabled" if not current else "disabled"
     embed = discord.Embed(
@@ -718,6 +3607,26 @@ async def toggle_author_attribution(ctx):
     )
     await ctx.send(embed=embed)
 
+@bot.hybrid_command(name="duplicates", description="Choose what happens to media that was already copied")
+@commands.has_permissions(manage_channels=True)
+async def duplicate_media_mode(ctx, mode: Literal["skip", "link", "off"]):
+    """Set how media already copied recently is handled"""
+    guild_id = str(ctx.guild.id)
+    bot.config["duplicate_media"][guild_id] = mode
+    bot.save_config(guild_id)
+    
+    descriptions = {
+        "skip": "Media that was already copied recently will be **skipped**",
+        "link": "Media that was already copied recently will be **linked** to the earlier copy",
+        "off": "Duplicate detection is **off** - all media will be copied"
+    }
+    embed = discord.Embed(
+        title="✅ Duplicate Handling Updated",
+        description=descriptions[mode],
+        color=0x00ff00
+    )
+    await ctx.send(embed=embed)
+
 @bot.hybrid_command(name="help", description="Show available commands and information")
 async def help_command(ctx):
     """Show help information"""
@@ -745,6 +3654,8 @@ async def help_command(ctx):
         name="Other Commands",
         value=(
             "`/toggle_author` - Toggle showing who posted the media\n"
+            "`/duplicates skip|link|off` - Handle media that was already copied\n"
+            "`/backfill start|status|stop` - Copy media posted before monitoring began\n"
             "`/help` - Show this help message"
         ),
         inline=False
@@ -788,6 +3699,89 @@ async def on_command_error(ctx, error):
     else:
         logger.error(f"Unhandled error: {error}")
 
+def run_cluster(token: str, status_queue):
+    """Entry point of a cluster process - bot picked up its shards from the environment"""
+    bot.status_queue = status_queue
+    bot.run(token)
+
+def recommended_shard_count(token: str) -> int:
+    """Ask Discord how many shards the bot should run"""
+    async def fetch():
+        async with aiohttp.ClientSession() as session:
+            async with session.get(
+                "https://discord.com/api/v10/gateway/bot",
+                headers={"Authorization": f"Bot {token}"}
+            ) as resp:
+                resp.raise_for_status()
+                return (await resp.json())["shards"]
+    return asyncio.run(fetch())
+
+def run_clusters(token: str, cluster_count: int):
+    """
+    Run the bot's shards split across cluster_count processes
+    
+    Each cluster is a separate process with its own event loop, queue and
+    copy workers, handling the shards cluster_id, cluster_id + cluster_count,
+    ... of SHARD_COUNT (Discord's recommendation when unset or "auto").
+    Clusters send their status back on a multiprocessing queue and are
+    restarted if they crash after having connected.
+    """
+    if SHARD_COUNT and SHARD_COUNT.lower() != "auto":
+        shard_count = int(SHARD_COUNT)
+    else:
+        shard_count = max(recommended_shard_count(token), cluster_count)
+    cluster_count = min(cluster_count, shard_count)
+    logger.info(f"Starting {cluster_count} clusters for {shard_count} shards")
+    
+    # Settings reach each cluster through its environment, read when it imports this file
+    context = multiprocessing.get_context("spawn")
+    status_queue = context.Queue()
+    processes = {}
+    connected = set()
+    
+    def start(cluster_id: int):
+        os.environ["SHARD_COUNT"] = str(shard_count)
+        os.environ["SHARD_IDS"] = ",".join(str(shard_id) for shard_id in range(cluster_id, shard_count, cluster_count))
+        os.environ["CLUSTER_ID"] = str(cluster_id)
+        process = context.Process(target=run_cluster, args=(token, status_queue), name=f"cluster-{cluster_id}")
+        process.start()
+        processes[cluster_id] = process
+    
+    for cluster_id in range(cluster_count):
+        start(cluster_id)
+    
+    try:
+        while processes:
+            try:
+                status = status_queue.get(timeout=5)
+            except queue.Empty:
+                status = None
+            if status is not None:
+                if status["state"] == "ready":
+                    connected.add(status["cluster"])
+                logger.info(
+                    f"Cluster {status['cluster']} (shards {status['shards']}): {status['state']}, "
+                    f"{status['guilds']} guilds, {status['queued']} queued, latency {status['latency_ms']} ms"
+                )
+            
+            for cluster_id, process in list(processes.items()):
+                if process.is_alive():
+                    continue
+                del processes[cluster_id]
+                logger.warning(f"Cluster {cluster_id} exited with code {process.exitcode}")
+                # Only restart clusters that had connected - one that never did won't next time either
+                if process.exitcode != 0 and cluster_id in connected:
+                    connected.discard(cluster_id)
+                    logger.info(f"Restarting cluster {cluster_id}")
+                    start(cluster_id)
+    except KeyboardInterrupt:
+        pass
+    finally:
+        for process in processes.values():
+            process.join(timeout=10)
+            if process.is_alive():
+                process.terminate()
+
 if __name__ == "__main__":
     # Get token from environment variable
     TOKEN = os.getenv("DISCORD_TOKEN")
@@ -797,8 +3791,17 @@ if __name__ == "__main__":
         print("Create a .env file with: DISCORD_TOKEN=your_bot_token_here")
         exit(1)
     
+    # CLUSTERS=n runs the shards in n processes, which share the config database
+    clusters = int(os.getenv("CLUSTERS", "1"))
+    if clusters > 1 and os.getenv("CONFIG_BACKEND", "json").lower() != "sqlite":
+        print("❌ CLUSTERS needs CONFIG_BACKEND=sqlite so the clusters can share the config")
+        exit(1)
+    
     try:
-        bot.run(TOKEN)
+        if clusters > 1:
+            run_clusters(TOKEN, clusters)
+        else:
+            bot.run(TOKEN)
     except discord.LoginFailure:
         print("❌ Invalid bot token! Please check your DISCORD_TOKEN")
     except Exception as e: